@@ -0,0 +1,359 @@
+import sys
+import os
+import contextlib
+import io
+import time
+import tracemalloc
+import re
+import json
+import numpy as np
+
+from fnode import FNode, FNodeType
+from fcache import FValueCache
+from fplan import FPlan
+from fcore import FCore
+from ftree import FTree
+from fparser import FParser
+from fexport import FExport
+from fpalette import FPalette
+from fcodec import FCodec
+from options import CURVE_FRAMES, CURVE_RESOLUTION
+
+
+def loadPresets(path):
+	with open(path) as f:
+		s = f.read()
+	with contextlib.redirect_stdout(io.StringIO()):
+		root = FNode.fromString(s)
+	presets = []
+	def recurse(n):
+		for c in n.children():
+			if(c.type() == FNodeType.SET):
+				recurse(c)
+			elif(c.state() != FNode.INVALID_CHILDREN):
+				presets.append(c)
+	recurse(root)
+	return presets
+
+
+# Reports how many tree nodes the plan compiler's subtree sharing saves per preset
+def dedupReport(paths):
+	paths = paths or [p for p in ('default_palette.json', 'user_palette.json') if os.path.exists(p)]
+	totalNodes = 0
+	totalUnique = 0
+	for path in paths:
+		for n in loadPresets(path):
+			try:
+				plan = n.plan()
+			except ValueError:
+				continue
+			totalNodes += plan.nodeCount
+			totalUnique += len(plan.dag)
+			print(f'{plan.dedupRatio():6.2f}x  {plan.nodeCount:5d} -> {len(plan.dag):5d}  {n.name() or n.formula() or FNode.TYPE_NAMES[n.type()]}')
+	if(totalUnique):
+		print(f'{totalNodes / totalUnique:6.2f}x  {totalNodes:5d} -> {totalUnique:5d}  total')
+
+
+SAMPLE_FORMULAS = [
+	'sin(x*pi)',
+	'sin(x*pi*3)*cos(y*pi)+tanh(x*4+z)*abs(x-y)/(1+x^2)',
+	'sqrt(abs(sin(x*7)))*w-ln(2+cos(z*x))+atan(y*x*20)',
+	'sign(sin(x*pi*(1+z*15)))*(1-abs(y))^3',
+	'e^(-(x*x)*(1+y*40))*cos(x*pi*8*z)'
+]
+
+
+def timeExecute(plan, repeat):
+	plan.execute()
+	t = time.perf_counter()
+	for _ in range(repeat):
+		v = plan.execute()
+	return (time.perf_counter() - t) / repeat, v
+
+
+# Compares float32 against float64 evaluation in speed, memory and accuracy.  The
+# error is relative to the float64 value, or absolute where that is below 1.
+def precisionReport(formulas, repeat=10):
+	print(f'{"f64 ms":>8} {"f32 ms":>8} {"speedup":>8} {"rel err":>10}  formula')
+	for s in formulas or SAMPLE_FORMULAS:
+		with contextlib.redirect_stdout(io.StringIO()):
+			n = FNode.fromString(s)
+		t64, v64 = timeExecute(n.plan(np.float64), repeat)
+		t32, v32 = timeExecute(n.plan(np.float32), repeat)
+		with np.errstate(all='ignore'):
+			err = np.nanmax(np.abs(v64 - v32) / np.maximum(np.abs(v64), 1))
+		print(f'{t64*1000:8.2f} {t32*1000:8.2f} {t64/t32:7.2f}x {err:10.2e}  {s}')
+	print(f'table size: {v64.nbytes/2**20:0.1f} MB float64, {v32.nbytes/2**20:0.1f} MB float32')
+
+
+# Evaluates every subtree of the sample formulas twice, the way the tree view does
+# when browsing them, under a range of value cache budgets (in MB) and reports the
+# resulting hit, miss and eviction counts
+def cacheReport(budgets):
+	nodes = []
+	def recurse(n):
+		nodes.append(n)
+		for c in n.children():
+			recurse(c)
+	with contextlib.redirect_stdout(io.StringIO()):
+		for s in SAMPLE_FORMULAS:
+			recurse(FNode.fromString(s))
+	print(f'{"budget":>8} {"hits":>6} {"misses":>6} {"evicted":>8} {"MB used":>8} {"s":>6}')
+	for mb in budgets or (16, 64, 256, 1024):
+		cache = FValueCache.instance()
+		cache.clear()
+		cache.setBudget(float(mb) * 2**20)
+		cache.hits = cache.misses = cache.evictions = 0
+		t = time.perf_counter()
+		with contextlib.redirect_stdout(io.StringIO()):
+			for _ in range(2):
+				for n in nodes:
+					n.value()
+		t = time.perf_counter() - t
+		s = cache.stats()
+		print(f'{mb:>8} {s["hits"]:6d} {s["misses"]:6d} {s["evictions"]:8d} {s["size"]/2**20:8.1f} {t:6.2f}')
+
+
+def timeCall(fn, repeat):
+	t = time.perf_counter()
+	for _ in range(repeat):
+		r = fn()
+	return (time.perf_counter() - t) / repeat, r
+
+
+# Parses and copies a formula of about n nodes as a plain FCore tree and as a tree
+# with an FNode wrapped around every node, as it would be when shown in a NodeView
+def coreReport(args, repeat=3):
+	n = int(args[0]) if args else 10000
+	s = '+'.join(f'sin(x*{i})' for i in range(n // 4))
+
+	def wrapAll(c):
+		FNode.wrap(c)
+		for cc in c.children():
+			wrapAll(cc)
+		return c
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		tCore, core = timeCall(lambda: FParser.parse(s), repeat)
+		tNode, _ = timeCall(lambda: wrapAll(FParser.parse(s)), repeat)
+		tCoreCopy, _ = timeCall(core.copy, repeat)
+		tNodeCopy, _ = timeCall(lambda: wrapAll(core.copy()), repeat)
+	print(f'{"":>6} {"FCore ms":>10} {"FNode ms":>10}')
+	print(f'{"parse":>6} {tCore*1000:10.1f} {tNode*1000:10.1f}')
+	print(f'{"copy":>6} {tCoreCopy*1000:10.1f} {tNodeCopy*1000:10.1f}')
+
+
+# Copies, deletes from and JSON round-trips a formula of about n nodes stored as an
+# FCore object tree and as an FTree
+def treeReport(args, repeat=3):
+	n = int(args[0]) if args else 10000
+	s = '+'.join(f'sin(x*{i})' for i in range(n // 4))
+	core = FParser.parse(s)
+	tree = FTree.fromNode(core)
+
+	def deleteCore():
+		c = core.copy()
+		for cc in c.children()[::2]:
+			c.removeChild(cc)
+	def deleteTree():
+		t = tree.copy()
+		t.delete(*list(t.children())[::2])
+
+	rows = [
+		('copy', lambda: core.copy(), lambda: tree.copy()),
+		('delete', deleteCore, deleteTree),
+		('json', lambda: FCore.fromJSON(core.asJSON()), lambda: FTree.fromJSON(tree.asJSON())),
+		('plan', lambda: FPlan.compile(core), lambda: FPlan.compile(tree))
+	]
+	print(f'{len(tree)} nodes')
+	print(f'{"":>6} {"FCore ms":>10} {"FTree ms":>10}')
+	for name, fCore, fTree in rows:
+		tCore, _ = timeCall(fCore, repeat)
+		tTree, _ = timeCall(fTree, repeat)
+		print(f'{name:>6} {tCore*1000:10.1f} {tTree*1000:10.1f}')
+
+
+# The regex based parser fromFormula used before FParser, kept for comparison
+def legacyParse(infixStr):
+	rexp = r'([a-z]+|[0-9.]+|==|>=|<=|&&|!=|\|\||[\(\)\^\/*\-+])'
+	tokens = re.findall(rexp, infixStr.lower())
+	outputQ = []
+	opStack = []
+
+	def tokenToNode(t, prevToken):
+		nType = FCore.TOKENS.get(t)
+		if(not nType):
+			n = FCore(FNodeType.CONSTANT)
+			n.setConstantValue(float(t))
+			return n
+		if(nType == FNodeType.SUBTRACT):
+			if(not prevToken or FCore.PRIORITY.get(FCore.TOKENS.get(prevToken)) or prevToken == '('):
+				nType = FNodeType.NEGATE
+		return FCore(nType)
+
+	def addToOutput(n):
+		if(n.isUnary()):
+			return outputQ.append(n)
+		rChild = outputQ.pop()
+		if(n.isFunction()):
+			n.addChild(rChild, collapse=True)
+			return outputQ.append(n)
+		if(n.type() == FNodeType.NEGATE):
+			rChild.negate()
+			return outputQ.append(rChild)
+		lChild = outputQ.pop()
+		n.addChild(lChild, collapse=True)
+		n.addChild(rChild, collapse=True)
+		outputQ.append(n)
+
+	for i, t in enumerate(tokens):
+		n = tokenToNode(t, None if i==0 else tokens[i-1])
+		if(n.isUnary()):
+			addToOutput(n)
+		elif(n.type() == FNodeType.OPEN_PAREN or n.isFunction() or n.type() == FNodeType.NEGATE):
+			opStack.append(n)
+		elif(n.isOperator()):
+			while(opStack and opStack[-1].type() != FNodeType.OPEN_PAREN and opStack[-1].priority() >= n.priority()):
+				addToOutput(opStack.pop())
+			opStack.append(n)
+		elif(n.type() == FNodeType.CLOSE_PAREN):
+			while(True):
+				nOp = opStack.pop()
+				if(nOp.type() == FNodeType.OPEN_PAREN):
+					break
+				addToOutput(nOp)
+			if(opStack and opStack[-1].isFunction()):
+				addToOutput(opStack.pop())
+	while(opStack):
+		addToOutput(opStack.pop())
+	return outputQ.pop()
+
+
+def generateFormula(terms, seed=0):
+	rng = np.random.default_rng(seed)
+	parts = []
+	for i in range(terms):
+		f = ['sin', 'cos', 'tanh', 'abs'][rng.integers(4)]
+		op = ['*', '/'][rng.integers(2)]
+		parts.append(f'{f}(x*{rng.integers(1, 20)}-y^2)' + op + f'({i%7}.5+z)')
+	return '+'.join(parts)
+
+
+# Times FParser against the previous regex parser on generated formulas of growing
+# length (in terms of about 15 tokens each)
+def parserReport(args, repeat=3):
+	print(f'{"tokens":>8} {"legacy ms":>10} {"FParser ms":>11} {"speedup":>8}')
+	for terms in [int(a) for a in args] or (10, 100, 1000, 10000):
+		s = generateFormula(terms)
+		tokens = sum(1 for _ in FParser.tokenize(s))
+		tLegacy, _ = timeCall(lambda: legacyParse(s), repeat)
+		tNew, _ = timeCall(lambda: FParser.parse(s), repeat)
+		print(f'{tokens:8d} {tLegacy*1000:10.1f} {tNew*1000:11.1f} {tLegacy/tNew:7.1f}x')
+
+
+# Evaluates the sample formulas at each resolution as a single block and in blocks
+# of frames, serially and on all threads, and reports the time and the peak memory
+# next to the table of each
+def chunkReport(args, repeat=5):
+	threads, chunkBytes = FPlan.THREADS, FPlan.CHUNK_BYTES
+	modes = [('whole', 1, 2**62), ('blocks', 1, chunkBytes), (f'{threads} threads', threads, chunkBytes)]
+	for resolution in [int(a) for a in args] or (CURVE_RESOLUTION, 4096):
+		print(f'{CURVE_FRAMES}x{resolution}')
+		print(' '.join(f'{m:>10} {"MB":>6}' for m, _, _ in modes) + '  formula')
+		for s in SAMPLE_FORMULAS:
+			plan = FPlan.compile(FParser.parse(s))
+			row = []
+			for _, FPlan.THREADS, FPlan.CHUNK_BYTES in modes:
+				out = np.empty((CURVE_FRAMES, resolution), plan.dtype)
+				plan._scratch = {}
+				tracemalloc.start()
+				plan.execute(out=out, resolution=resolution)
+				peak = tracemalloc.get_traced_memory()[1]
+				tracemalloc.stop()
+				t, _ = timeCall(lambda: plan.execute(out=out, resolution=resolution), repeat)
+				row.append(f'{t*1000:7.1f} ms {peak/2**20:6.1f}')
+			print(' '.join(row) + f'  {s}')
+	FPlan.THREADS, FPlan.CHUNK_BYTES = threads, chunkBytes
+
+
+# Times the octave mipmaps of the sample formulas' tables, evaluated at each given
+# resolution, with levels at full resolution and halved per octave
+def mipmapReport(args, repeat=5):
+	print(f'{"size":>10} {"levels":>6} {"ms":>8} {"shrunk ms":>10}  formula')
+	for resolution in [int(a) for a in args] or (CURVE_RESOLUTION, 2048):
+		for s in SAMPLE_FORMULAS:
+			with np.errstate(all='ignore'):
+				v = FPlan.compile(FParser.parse(s)).execute(resolution=resolution)
+			t, mips = timeCall(lambda: FExport.mipmaps(v, normalize=True, removeDC=True), repeat)
+			tShrunk, _ = timeCall(lambda: FExport.mipmaps(v, normalize=True, removeDC=True, shrink=True), repeat)
+			print(f'{v.shape[0]:>4}x{v.shape[1]:<5} {len(mips):6d} {t*1000:8.1f} {tShrunk*1000:10.1f}  {s}')
+
+
+# Writes palettes of n presets with generated formulas as JSON and in the indexed
+# format, and times opening each, then loading a single preset and all of them from
+# the indexed one
+def paletteReport(args, terms=20):
+	import tempfile
+	print(f'{"presets":>8} {"MB":>6} {"json ms":>8} {"index ms":>9} {"1 ms":>6} {"all ms":>7}')
+	with tempfile.TemporaryDirectory() as d:
+		for n in [int(a) for a in args] or (100, 1000, 5000):
+			palette = FPalette()
+			for i in range(0, n, 100):
+				folder = FCore(FNodeType.SET)
+				folder.setName(f'folder {i // 100}')
+				palette.root.addChild(folder)
+				for k in range(i, min(i + 100, n)):
+					c = FParser.parse(generateFormula(terms, k))
+					c.setName(f'preset {k}')
+					folder.addChild(c)
+			jsonPath, indexPath = os.path.join(d, 'palette.json'), os.path.join(d, 'palette.fpal')
+			with open(jsonPath, 'w') as f:
+				f.write(json.dumps(palette.root.asJSON()))
+			palette.save(indexPath)
+			tJson, _ = timeCall(lambda: FPalette.open(jsonPath), 1)
+			tIndex, palette = timeCall(lambda: FPalette.open(indexPath), 1)
+			tOne, _ = timeCall(lambda: palette.load([palette.root.children()[0].children()[0]]), 1)
+			tAll, _ = timeCall(lambda: palette.loadAll(palette.root), 1)
+			print(f'{n:8d} {os.path.getsize(jsonPath)/2**20:6.1f} {tJson*1000:8.1f} {tIndex*1000:9.1f} {tOne*1000:6.2f} {tAll*1000:7.1f}')
+
+
+# Encodes and decodes generated formulas of growing length (in terms of about 15
+# tokens each) as JSON and with FCodec, into FCore trees and into the FTree store
+def codecReport(args, repeat=5):
+	print(f'{"nodes":>8} {"JSON kB":>8} {"FCodec kB":>10} {"":>6} {"JSON ms":>8} {"FCodec ms":>10} {"speedup":>8}')
+	for terms in [int(a) for a in args] or (10, 100, 1000, 10000):
+		core = FParser.parse(generateFormula(terms))
+		tree = FTree.fromNode(core)
+		s = json.dumps(core.asJSON())
+		b = FCodec.encode(core)
+		rows = [
+			('encode', lambda: json.dumps(core.asJSON()), lambda: FCodec.encode(core)),
+			('FCore', lambda: FCore.fromJSON(json.loads(s)), lambda: FCodec.decodeCore(b)),
+			('FTree', lambda: FTree.fromJSON(json.loads(s)), lambda: FCodec.decode(b))
+		]
+		for k, (name, fJson, fCodec) in enumerate(rows):
+			tJson, _ = timeCall(fJson, repeat)
+			tCodec, _ = timeCall(fCodec, repeat)
+			sizes = f'{len(tree):8d} {len(s)/1024:8.1f} {len(b)/1024:10.1f}' if not k else ' ' * 28
+			print(f'{sizes} {name:>6} {tJson*1000:8.2f} {tCodec*1000:10.2f} {tJson/tCodec:7.1f}x')
+
+
+BENCHMARKS = {
+	'dedup': dedupReport,
+	'precision': precisionReport,
+	'cache': cacheReport,
+	'core': coreReport,
+	'tree': treeReport,
+	'parser': parserReport,
+	'chunks': chunkReport,
+	'mipmaps': mipmapReport,
+	'palette': paletteReport,
+	'codec': codecReport
+}
+
+
+if __name__ == '__main__':
+	if(len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS):
+		print(f'usage: benchmarks.py [{"|".join(BENCHMARKS)}] [args...]')
+		exit(1)
+	BENCHMARKS[sys.argv[1]](sys.argv[2:])
@@ -0,0 +1,149 @@
+import threading
+import re
+from collections import OrderedDict
+
+from options import VALUE_CACHE_BYTES, FORMULA_CACHE_NODES
+
+
+# Shared, memory-bounded store of evaluated node values.  Values are keyed by the
+# structural key of the simplified subtree, so identical expressions share a single
+# entry, and the least recently used entries are evicted once the byte budget is
+# exceeded.  Evicted values are simply recomputed by their node on the next access.
+class FValueCache:
+	INSTANCE = None
+
+	def __init__(self, budget=VALUE_CACHE_BYTES):
+		self.budget = budget
+		self.entries = OrderedDict()
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.lock = threading.Lock()
+
+
+	def __repr__(self) -> str:
+		s = self.stats()
+		return f'FValueCache({s["entries"]} entries, {s["size"]/2**20:0.1f}/{s["budget"]/2**20:0.1f} MB, {s["hits"]} hits, {s["misses"]} misses, {s["evictions"]} evictions)'
+
+
+	def __contains__(self, key):
+		with self.lock:
+			return key in self.entries
+
+
+	# Broadcast results are views, only the memory they actually keep alive counts
+	@classmethod
+	def sizeOf(_, v):
+		while(getattr(v, 'base', None) is not None):
+			v = v.base
+		return getattr(v, 'nbytes', 0)
+
+
+	def get(self, key):
+		with self.lock:
+			e = self.entries.get(key)
+			if(e is None):
+				self.misses += 1
+				return None
+			self.entries.move_to_end(key)
+			self.hits += 1
+			return e[0]
+
+
+	# Looks up a value without counting it or refreshing its position
+	def peek(self, key):
+		with self.lock:
+			e = self.entries.get(key)
+			return None if e is None else e[0]
+
+
+	def put(self, key, v):
+		nbytes = self.sizeOf(v)
+		with self.lock:
+			old = self.entries.pop(key, None)
+			if(old is not None):
+				self.size -= old[1]
+			if(nbytes > self.budget):
+				return
+			self.entries[key] = (v, nbytes)
+			self.size += nbytes
+			self._shrink()
+
+
+	def setBudget(self, budget):
+		with self.lock:
+			self.budget = budget
+			self._shrink()
+
+
+	# Evicts least recently used entries until the budget is met, lock held
+	def _shrink(self):
+		while(self.entries and self.size > self.budget):
+			_, (_, n) = self.entries.popitem(last=False)
+			self.size -= n
+			self.evictions += 1
+
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+			self.size = 0
+
+
+	def stats(self):
+		with self.lock:
+			return {
+				'entries': len(self.entries),
+				'size': self.size,
+				'budget': self.budget,
+				'hits': self.hits,
+				'misses': self.misses,
+				'evictions': self.evictions
+			}
+
+
+	@classmethod
+	def instance(_):
+		if(not FValueCache.INSTANCE):
+			FValueCache.INSTANCE = FValueCache()
+		return FValueCache.INSTANCE
+
+
+# Recently parsed formulas and JSON strings, so that going back to one of them skips
+# parsing and simplification.  Entries hold the parsed FCore tree, which callers copy
+# before use, and its simplified FTerm, whose key also finds the evaluated wavetable
+# in the FValueCache.  The budget counts tree nodes.
+class FFormulaCache(FValueCache):
+	INSTANCE = None
+
+	def __init__(self, budget=FORMULA_CACHE_NODES):
+		super().__init__(budget)
+
+
+	def __repr__(self) -> str:
+		s = self.stats()
+		return f'FFormulaCache({s["entries"]} entries, {s["size"]}/{s["budget"]} nodes, {s["hits"]} hits, {s["misses"]} misses, {s["evictions"]} evictions)'
+
+
+	# Entries are (core, term, node count)
+	@classmethod
+	def sizeOf(_, v):
+		return v[2]
+
+
+	# Whitespace around symbols is dropped and formulas are case-insensitive.  JSON is
+	# only stripped, names inside it are kept as they are.
+	@classmethod
+	def normalize(_, s):
+		s = s.strip()
+		if(s.startswith('{')):
+			return s
+		return re.sub(r'\s*([^\w.\s])\s*', r'\1', re.sub(r'\s+', ' ', s)).lower()
+
+
+	@classmethod
+	def instance(_):
+		if(not FFormulaCache.INSTANCE):
+			FFormulaCache.INSTANCE = FFormulaCache()
+		return FFormulaCache.INSTANCE
@@ -0,0 +1,248 @@
+import os
+import struct
+import numpy as np
+
+from ftypes import FNodeType
+from fcore import FCore
+from ftree import FTree
+
+
+# Compact binary form of expression trees, as an alternative to their JSON.
+#
+#   magic 'FT\x01', flags, varint node count, varint size of the child counts
+#   type codes    one byte per node in preorder, the index of the type in FNodeType
+#                 with the top bit set for negated nodes
+#   child counts  one LEB128 varint per node in preorder
+#   constants     the values of the CONSTANT nodes in preorder, as little-endian
+#                 float32 if they all fit in one (flag 1) or float64
+#   names         varint count, then per named node the varint distance from the
+#                 previous named node, the varint length and the UTF-8 bytes
+#
+# Sections are read as numpy views of the buffer and turned into an FTree with a
+# few vectorized passes, without any per-node Python, except for names.
+class FCodec:
+	MAGIC = b'FT\x01'
+	FLOAT32 = 1
+
+	MIME_TYPE = 'application/x-function-designer-tree'
+
+	# Container of a tree and optionally its evaluated table, the table being stored in
+	# the .npy format, 64-byte aligned after the tree
+	DOCUMENT_MAGIC = b'FDOC\x01\x00\x00\x00'
+	DOCUMENT_ALIGN = 64
+
+	TYPES = np.array(list(FNodeType), np.int16)
+	CODES = np.full(1000, 0x7f, np.uint8)
+	CODES[TYPES] = np.arange(len(TYPES))
+
+
+	@classmethod
+	def packVarint(_, v):
+		b = bytearray()
+		while(v >= 0x80):
+			b.append(v & 0x7f | 0x80)
+			v >>= 7
+		b.append(v)
+		return bytes(b)
+
+
+	# Returns the value of the varint at offset and the offset after it
+	@classmethod
+	def unpackVarint(_, buf, offset):
+		v = 0
+		shift = 0
+		while(True):
+			if(offset >= len(buf)):
+				raise ValueError('Encoded tree is truncated')
+			b = buf[offset]
+			offset += 1
+			v |= (b & 0x7f) << shift
+			if(b < 0x80):
+				return v, offset
+			shift += 7
+			if(shift > 63):
+				raise ValueError('Encoded tree is corrupt')
+
+
+	# Returns count items of dtype at offset in buf and the offset after them
+	@classmethod
+	def unpackArray(_, buf, dtype, count, offset):
+		end = offset + count * np.dtype(dtype).itemsize
+		if(end > len(buf)):
+			raise ValueError('Encoded tree is truncated')
+		return np.frombuffer(buf, dtype, count, offset), end
+
+
+	@classmethod
+	def packVarints(_, v):
+		v = np.asarray(v, np.uint64)
+		if(not len(v) or v.max() < 0x80):
+			return v.astype(np.uint8).tobytes()
+		nbytes = np.ones(len(v), np.int64)
+		for shift in range(7, 64, 7):
+			nbytes += v >= np.uint64(1 << shift)
+		starts = np.cumsum(nbytes) - nbytes
+		out = np.zeros(int(nbytes.sum()), np.uint8)
+		for k in range(int(nbytes.max())):
+			m = nbytes > k
+			out[starts[m] + k] = ((v[m] >> np.uint64(7 * k)) & np.uint64(0x7f)) | np.where(nbytes[m] - 1 > k, 0x80, 0).astype(np.uint64)
+		return out.tobytes()
+
+
+	@classmethod
+	def unpackVarints(_, b):
+		last = b < 0x80
+		if(last.all()):
+			return b.astype(np.int64)
+		if(not last[-1]):
+			raise ValueError('Encoded tree is truncated')
+		if(np.diff(np.flatnonzero(last), prepend=-1).max() > 9):
+			raise ValueError('Encoded tree is corrupt')
+		starts = np.concatenate(([0], np.flatnonzero(last)[:-1] + 1))
+		group = np.concatenate(([0], np.cumsum(last[:-1])))
+		shifts = (7 * (np.arange(len(b)) - starts[group])).astype(np.uint64)
+		return np.add.reduceat((b & 0x7f).astype(np.uint64) << shifts, starts).astype(np.int64)
+
+
+	# Encodes an FTree, or an FCore tree
+	@classmethod
+	def encode(_, n) -> bytes:
+		if(isinstance(n, FTree)):
+			types, negated = n.types, n.negated
+			parents = np.arange(len(n)) - n.parentOffsets
+			counts = np.bincount(parents[1:], minlength=len(n))
+			constants = n.constants[types == FNodeType.CONSTANT]
+			named = np.flatnonzero(n.names != None)
+			names = list(zip(named.tolist(), n.names[named]))
+		else:
+			types, negated, counts, constants, names = [], [], [], [], []
+			stack = [n]
+			while(stack):
+				c = stack.pop()
+				if(c._type == FNodeType.CONSTANT):
+					constants.append(c.value())
+					negated.append(False)
+				else:
+					negated.append(c._negated)
+				if(c._name):
+					names.append((len(types), c._name))
+				types.append(c._type)
+				counts.append(len(c._children))
+				stack.extend(reversed(c._children))
+			types = np.array(types, np.int16)
+
+		flags = 0
+		constants = np.asarray(constants, '<f8')
+		with np.errstate(over='ignore'):
+			isFloat32 = np.array_equal(constants.astype('<f4'), constants, equal_nan=True)
+		if(isFloat32):
+			constants = constants.astype('<f4')
+			flags |= FCodec.FLOAT32
+		codes = FCodec.CODES[types] | (np.asarray(negated, np.uint8) << 7)
+		counts = FCodec.packVarints(counts)
+
+		out = [FCodec.MAGIC, bytes((flags,)), FCodec.packVarint(len(types)), FCodec.packVarint(len(counts)), codes.tobytes(), counts, constants.tobytes(), FCodec.packVarint(len(names))]
+		prev = 0
+		for i, name in names:
+			name = name.encode()
+			out += (FCodec.packVarint(i - prev), FCodec.packVarint(len(name)), name)
+			prev = i
+		return b''.join(out)
+
+
+	@classmethod
+	def decode(_, buf) -> FTree:
+		buf = memoryview(buf).cast('B')
+		if(len(buf) < 4 or bytes(buf[:3]) != FCodec.MAGIC):
+			raise ValueError('Not an encoded tree')
+		flags = buf[3]
+		if(flags & ~FCodec.FLOAT32):
+			raise ValueError('Encoded tree is corrupt')
+		n, offset = FCodec.unpackVarint(buf, 4)
+		countsSize, offset = FCodec.unpackVarint(buf, offset)
+		if(not n):
+			raise ValueError('Encoded tree is empty')
+
+		codes, offset = FCodec.unpackArray(buf, np.uint8, n, offset)
+		counts, offset = FCodec.unpackArray(buf, np.uint8, countsSize, offset)
+		counts = FCodec.unpackVarints(counts)
+		if(len(counts) != n or counts.min() < 0 or counts.sum() != n - 1 or (codes & 0x7f).max() >= len(FCodec.TYPES)):
+			raise ValueError('Encoded tree is corrupt')
+
+		t = FTree()
+		t.types = FCodec.TYPES[codes & 0x7f]
+		t.negated = codes >= 0x80
+
+		# pending[k] is the number of nodes still to come before node k, the subtree of
+		# node i ends at the first node after it where that drops below pending[i]
+		idx = np.arange(n)
+		pending = np.concatenate(([1], 1 + np.cumsum(counts - 1)))
+		if(pending[-1] != 0 or pending[:-1].min() < 1):
+			raise ValueError('Encoded tree is corrupt')
+		keys = np.sort(pending * (n + 2) + np.arange(n + 1))
+		ends = keys[np.searchsorted(keys, (pending[:-1] - 1) * (n + 2) + idx + 1)] % (n + 2)
+		t.sizes = (ends - idx).astype(np.int32)
+
+		# The parent of node i is the last node before it one level up
+		depths = idx + 1 - np.cumsum(np.bincount(ends, minlength=n + 1))[:n]
+		keys = np.sort(depths * (n + 1) + idx)
+		parents = keys[np.searchsorted(keys, (depths - 1) * (n + 1) + idx) - 1] % (n + 1)
+		t.parentOffsets = (idx - parents).astype(np.int32)
+		t.parentOffsets[0] = 0
+		t._relink()
+
+		isConstant = t.types == FNodeType.CONSTANT
+		dtype = '<f4' if flags & FCodec.FLOAT32 else '<f8'
+		t.constants = np.zeros(n, np.float64)
+		t.constants[isConstant], offset = FCodec.unpackArray(buf, dtype, int(isConstant.sum()), offset)
+
+		t.names = np.full(n, None, object)
+		count, offset = FCodec.unpackVarint(buf, offset)
+		i = 0
+		for _ in range(count):
+			delta, offset = FCodec.unpackVarint(buf, offset)
+			size, offset = FCodec.unpackVarint(buf, offset)
+			i += delta
+			if(i >= n or offset + size > len(buf)):
+				raise ValueError('Encoded tree is corrupt')
+			t.names[i] = str(buf[offset:offset + size], 'utf-8')
+			offset += size
+		if(offset != len(buf)):
+			raise ValueError('Encoded tree is corrupt')
+		return t
+
+
+	@classmethod
+	def decodeCore(_, buf) -> FCore:
+		return FCodec.decode(buf).toCore()
+
+
+	# Writes the tree and, if given, its evaluated table to a document at path
+	@classmethod
+	def save(_, path, n, table=None):
+		tree = FCodec.encode(n)
+		with open(path, 'wb') as f:
+			f.write(FCodec.DOCUMENT_MAGIC)
+			f.write(struct.pack('<Q', len(tree)))
+			f.write(tree)
+			if(table is not None):
+				f.write(b'\0' * (-f.tell() % FCodec.DOCUMENT_ALIGN))
+				np.lib.format.write_array(f, np.ascontiguousarray(table), allow_pickle=False)
+
+
+	# Returns the FTree of the document at path and its table, or None if it has none
+	@classmethod
+	def load(_, path):
+		with open(path, 'rb') as f:
+			if(f.read(len(FCodec.DOCUMENT_MAGIC)) != FCodec.DOCUMENT_MAGIC):
+				raise ValueError('Not a function document')
+			header = f.read(8)
+			if(len(header) < 8):
+				raise ValueError('Function document is truncated')
+			size, = struct.unpack('<Q', header)
+			tree = FCodec.decode(f.read(size))
+			f.seek(-f.tell() % FCodec.DOCUMENT_ALIGN, 1)
+			table = None
+			if(f.tell() < os.fstat(f.fileno()).st_size):
+				table = np.lib.format.read_array(f, allow_pickle=False)
+		return tree, table
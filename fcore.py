@@ -0,0 +1,486 @@
+import re
+import json
+
+from ftypes import FNodeType
+
+
+# Plain, slotted expression tree node.  Parsing, copying, serialization and
+# evaluation work on these directly, FNode only wraps the nodes that are actually
+# shown in a NodeView.  Formulas are cached per subtree and dropped up to the root
+# whenever the subtree changes.
+class FCore:
+	__slots__ = ('_type', '_name', '_negated', '_constant', '_parent', '_children', '_formula', '_valid', '_node')
+
+	JSON_TOKENS = re.compile(r'[{}\[\]:,]|"(?:[^"\\]|\\.)*"|[^\s{}\[\]:,]+')
+
+	STRING_FUNCTIONS = {
+		FNodeType.PI: lambda *_: 'pi',
+		FNodeType.E: lambda *_: 'e',
+		FNodeType.W: lambda *_: 'w',
+		FNodeType.X: lambda *_: 'x',
+		FNodeType.Y: lambda *_: 'y',
+		FNodeType.Z: lambda *_: 'z',
+		FNodeType.SIN: lambda *c: f'sin({c[0]})',
+		FNodeType.COS: lambda *c: f'cos({c[0]})',
+		FNodeType.TAN: lambda *c: f'tan({c[0]})',
+		FNodeType.ASIN: lambda *c: f'asin({c[0]})',
+		FNodeType.ACOS: lambda *c: f'acos({c[0]})',
+		FNodeType.ATAN: lambda *c: f'atan({c[0]})',
+		FNodeType.SINH: lambda *c: f'sinh({c[0]})',
+		FNodeType.COSH: lambda *c: f'cosh({c[0]})',
+		FNodeType.TANH: lambda *c: f'tanh({c[0]})',
+		FNodeType.ASINH: lambda *c: f'asinh({c[0]})',
+		FNodeType.ACOSH: lambda *c: f'acosh({c[0]})',
+		FNodeType.ATANH: lambda *c: f'atanh({c[0]})',
+		FNodeType.LOG2: lambda *c: f'log2({c[0]})',
+		FNodeType.LOG10: lambda *c: f'log10({c[0]})',
+		FNodeType.LN: lambda *c: f'ln({c[0]})',
+		FNodeType.SQRT: lambda *c: f'sqrt({c[0]})',
+		FNodeType.SIGN: lambda *c: f'sign({c[0]})',
+		FNodeType.RINT: lambda *c: f'rint({c[0]})',
+		FNodeType.ABS: lambda *c: f'abs({c[0]})',
+		FNodeType.NEGATE: lambda *c: f'-{c[0]}',
+		FNodeType.ADD: lambda *c: '+'.join(c),
+		FNodeType.SUBTRACT: lambda *c: '-'.join(c),
+		FNodeType.MULTIPLY: lambda *c: '*'.join(c),
+		FNodeType.DIVIDE: lambda *c: '/'.join(c),
+		FNodeType.EXPONENT: lambda *c: '^'.join(c),
+		FNodeType.EQUAL: lambda *c: '=='.join(c),
+		FNodeType.NOT_EQUAL: lambda *c: '!='.join(c),
+		FNodeType.LESS_THAN: lambda *c: '<'.join(c),
+		FNodeType.LESS_EQ: lambda *c: '<='.join(c),
+		FNodeType.GREATER_THAN: lambda *c: '>'.join(c),
+		FNodeType.GREATER_EQ: lambda *c: '>='.join(c),
+		FNodeType.OR: lambda *c: '||'.join(c),
+		FNodeType.AND: lambda *c: '&&'.join(c),
+		FNodeType.MIN: lambda *c: 'min(' + ','.join(c) + ')',
+		FNodeType.MAX: lambda *c: 'max(' + ','.join(c) + ')',
+		FNodeType.SUM: lambda *c: 'sum(' + ','.join(c) + ')',
+		FNodeType.AVG: lambda *c: 'avg(' + ','.join(c) + ')',
+	}
+
+
+	PRIORITY = {
+		FNodeType.NEGATE: 8,
+		FNodeType.EXPONENT: 7,
+		FNodeType.DIVIDE: 6,
+		FNodeType.MULTIPLY: 6,
+		FNodeType.SUBTRACT: 5,
+		FNodeType.ADD: 5,
+		FNodeType.LESS_THAN: 4,
+		FNodeType.GREATER_THAN: 4,
+		FNodeType.LESS_EQ: 4,
+		FNodeType.GREATER_EQ: 4,
+		FNodeType.EQUAL: 4,
+		FNodeType.NOT_EQUAL: 4,
+		FNodeType.OR: 2,
+		FNodeType.AND: 1
+	}
+
+
+	TOKENS = {
+		'||': FNodeType.OR,
+		'z': FNodeType.Z,
+		'y': FNodeType.Y,
+		'x': FNodeType.X,
+		'w': FNodeType.W,
+		'tanh': FNodeType.TANH,
+		'tan': FNodeType.TAN,
+		'sum': FNodeType.SUM,
+		'sqrt': FNodeType.SQRT,
+		'sinh': FNodeType.SINH,
+		'sin': FNodeType.SIN,
+		'sign': FNodeType.SIGN,
+		'rint': FNodeType.RINT,
+		'pi': FNodeType.PI,
+		'min': FNodeType.MIN,
+		'max': FNodeType.MAX,
+		'log2': FNodeType.LOG2,
+		'log10': FNodeType.LOG10,
+		'ln': FNodeType.LN,
+		'e': FNodeType.E,
+		'cosh': FNodeType.COSH,
+		'cos': FNodeType.COS,
+		'avg': FNodeType.AVG,
+		'atanh': FNodeType.ATANH,
+		'atan': FNodeType.ATAN,
+		'asinh': FNodeType.ASINH,
+		'asin': FNodeType.ASIN,
+		'acosh': FNodeType.ACOSH,
+		'acos': FNodeType.ACOS,
+		'abs': FNodeType.ABS,
+		'^': FNodeType.EXPONENT,
+		'>=': FNodeType.GREATER_EQ,
+		'>': FNodeType.GREATER_THAN,
+		'==': FNodeType.EQUAL,
+		'<=': FNodeType.LESS_EQ,
+		'<': FNodeType.LESS_THAN,
+		'/': FNodeType.DIVIDE,
+		'-': FNodeType.SUBTRACT,
+		'+': FNodeType.ADD,
+		'*': FNodeType.MULTIPLY,
+		')': FNodeType.CLOSE_PAREN,
+		'(': FNodeType.OPEN_PAREN,
+		'&&': FNodeType.AND,
+		'!=': FNodeType.NOT_EQUAL
+	}
+
+
+	TYPE_NAMES = {
+		FNodeType.CONSTANT: 'constant value',
+		FNodeType.PI: 'pi',
+		FNodeType.E: 'e',
+		FNodeType.W: 'w',
+		FNodeType.X: 'x',
+		FNodeType.Y: 'y',
+		FNodeType.Z: 'z',
+		FNodeType.SIN: 'sin',
+		FNodeType.COS: 'cos',
+		FNodeType.TAN: 'tan',
+		FNodeType.ASIN: 'arcsin',
+		FNodeType.ACOS: 'arccos',
+		FNodeType.ATAN: 'arctan',
+		FNodeType.SINH: 'sinh',
+		FNodeType.COSH: 'cosh',
+		FNodeType.TANH: 'tanh',
+		FNodeType.ASINH: 'asinh',
+		FNodeType.ACOSH: 'acosh',
+		FNodeType.ATANH: 'atanh',
+		FNodeType.LOG2: 'log (base 2)',
+		FNodeType.LOG10: 'log (base 10)',
+		FNodeType.LN: 'log (base e)',
+		FNodeType.SQRT: 'square root',
+		FNodeType.SIGN: 'sign',
+		FNodeType.RINT: 'round',
+		FNodeType.ABS: 'absolute value',
+		FNodeType.NEGATE: 'negate',
+		FNodeType.ADD: 'plus',
+		FNodeType.SUBTRACT: 'minus',
+		FNodeType.MULTIPLY: 'multiply',
+		FNodeType.DIVIDE: 'divide',
+		FNodeType.EXPONENT: 'exponential',
+		FNodeType.EQUAL: 'equals',
+		FNodeType.NOT_EQUAL: 'not equals',
+		FNodeType.LESS_THAN: 'less than',
+		FNodeType.LESS_EQ: 'less or eq.',
+		FNodeType.GREATER_THAN: 'greater than',
+		FNodeType.GREATER_EQ: 'greater or eq.',
+		FNodeType.OR: 'or',
+		FNodeType.AND: 'and',
+		FNodeType.MIN: 'minimum',
+		FNodeType.MAX: 'maximum',
+		FNodeType.SUM: 'sum',
+		FNodeType.AVG: 'average'
+	}
+
+
+	def __init__(self, type:int):
+		self._type = type
+		self._name = None
+		self._negated = False
+		self._constant = 0
+		self._parent = None
+		self._children = []
+		self._formula = None
+		self._valid = False
+		self._node = None
+
+
+	def __repr__(self) -> str:
+		return f'{self._name if self._name else self._constant if self._type == FNodeType.CONSTANT else ""} {self._type.name} C{len(self._children)}'
+
+
+	def type(self):
+		return self._type
+
+	def setType(self, t):
+		self._type = t
+		self._touch()
+
+	def name(self):
+		return self._name
+
+	def setName(self, name):
+		self._name = name
+
+	def parent(self):
+		return self._parent
+
+	def children(self):
+		return self._children
+
+	# FNode wrapping this node, if it is shown anywhere
+	def node(self):
+		return self._node
+
+	def value(self):
+		return -self._constant if self._negated else self._constant
+
+	def isNegated(self):
+		return self._negated
+
+	def negate(self):
+		self._negated = not self._negated
+		self._touch()
+
+	def setConstantValue(self, value):
+		assert self._type == FNodeType.CONSTANT
+		self._negated = value < 0
+		self._constant = -value if self._negated else value
+		self._touch()
+
+	def isUnary(self):
+		return self._type < 100
+
+	def isOperator(self):
+		return 100 <= self._type <= 112
+
+	def isFunction(self):
+		return 200 <= self._type < 400
+
+	def isAggregate(self):
+		return 350 <= self._type < 400
+
+	def priority(self):
+		return FCore.PRIORITY.get(self._type)
+
+	def childLimit(self):
+		return 0 if self._type < 40 else 1 if self._type < 100 else float('inf')
+
+	def hasValidChildren(self):
+		if(self.isUnary()):
+			return len(self._children) == 0
+		if(self.isFunction() and not self.isAggregate()):
+			return len(self._children) == 1
+		return len(self._children) > 0
+
+
+	# Formula of the subtree, empty if any node in it has an invalid child count
+	def formula(self):
+		if(self._formula is None):
+			self._update()
+		return self._formula
+
+	def isValid(self):
+		if(self._formula is None):
+			self._update()
+		return self._valid
+
+
+	# Updates every node of the subtree without a cached formula, children first, from
+	# an explicit stack so that deep trees do not hit the recursion limit.  A cached
+	# formula implies cached children, so the walk stops at cached nodes.
+	def _update(self):
+		order = []
+		stack = [self]
+		while(stack):
+			n = stack.pop()
+			order.append(n)
+			stack.extend(c for c in n._children if c._formula is None)
+		for n in reversed(order):
+			n._updateNode()
+
+
+	def _updateNode(self):
+		self._valid = all([c._valid for c in self._children])
+		self._formula = ''
+		if(self._type == FNodeType.ROOT or self._type == FNodeType.SET):
+			return
+		self._valid = self._valid and self.hasValidChildren()
+		if(not self._valid):
+			return
+
+		if(self._type == FNodeType.CONSTANT):
+			f = str(int(self._constant) if not self._constant % 1 else self._constant)
+		else:
+			strFn = FCore.STRING_FUNCTIONS[self._type]
+			pSelf = FCore.PRIORITY.get(self._type)
+			if(pSelf):
+				cStrsParens = []
+				for i, c in enumerate(self._children):
+					# Operands after the first need parentheses at equal priority too,
+					# unless the operator is associative
+					pC = FCore.PRIORITY.get(c._type)
+					if(pC and (pSelf > pC or (pSelf == pC and i and self._type not in (FNodeType.ADD, FNodeType.MULTIPLY)))):
+						cStrsParens.append(f'({c._formula})')
+					else:
+						cStrsParens.append(c._formula)
+				f = strFn(*cStrsParens)
+			else:
+				f = strFn(*[c._formula for c in self._children])
+
+		if(self._negated):
+			if(len(self._children) > 1):
+				f = f'-({f})'
+			else:
+				f = f'-{f}'
+		self._formula = f
+
+
+	# Drops the cached formulas of the node and its ancestors
+	def _touch(self):
+		n = self
+		while(n is not None and n._formula is not None):
+			n._formula = None
+			n = n._parent
+
+
+	def addChild(self, child, idx=None, collapse=False):
+		if(idx == None):
+			idx = len(self._children)
+		if(child._parent):
+			child._parent.removeChild(child)
+		if(collapse and child._type == self._type):
+			for c in child._children:
+				c._parent = self
+			self._children[idx:idx] = child._children
+		else:
+			child._parent = self
+			self._children.insert(idx, child)
+		self._touch()
+
+
+	def removeChild(self, child):
+		child._parent = None
+		self._children.remove(child)
+		self._touch()
+
+
+	def asJSON(self):
+		out = []
+		stack = [(self, out)]
+		while(stack):
+			n, siblings = stack.pop()
+			j = {'type': int(n._type)}
+			if(n._name):
+				j['name'] = n._name
+			if(n._type == FNodeType.CONSTANT):
+				v = n.value()
+				j['value'] = int(v) if not v % 1 else v
+			elif(n._negated):
+				j['negated'] = True
+			siblings.append(j)
+			if(n._children):
+				j['children'] = []
+				stack.extend((c, j['children']) for c in reversed(n._children))
+		return out[0]
+
+
+	def nodeCount(self):
+		count = 0
+		stack = [self]
+		while(stack):
+			n = stack.pop()
+			count += 1
+			stack.extend(n._children)
+		return count
+
+
+	def copy(self):
+		n = self._copyNode()
+		stack = [(self, n)]
+		while(stack):
+			src, dst = stack.pop()
+			dst._children = [c._copyNode() for c in src._children]
+			for c, cc in zip(src._children, dst._children):
+				cc._parent = dst
+				stack.append((c, cc))
+		return n
+
+
+	def _copyNode(self):
+		n = FCore(self._type)
+		n._name = self._name
+		n._negated = self._negated
+		n._constant = self._constant
+		n._formula = self._formula
+		n._valid = self._valid
+		return n
+
+
+	@classmethod
+	def fromJSON(_, j):
+		root = None
+		stack = [(j, None)]
+		while(stack):
+			j, p = stack.pop()
+			n = FCore(FNodeType(j['type']))
+			n._name = j.get('name')
+			if(n._type == FNodeType.CONSTANT):
+				n.setConstantValue(j.get('value') or 0)
+			else:
+				n._negated = bool(j.get('negated'))
+			if(p):
+				n._parent = p
+				p._children.append(n)
+			else:
+				root = n
+			stack.extend((c, n) for c in reversed(j.get('children') or []))
+		return root
+
+
+	# json.dumps() of a tree in the asJSON() format.  Trees too deep for the json
+	# module are written a node at a time.
+	@classmethod
+	def dumps(_, j):
+		try:
+			return json.dumps(j)
+		except RecursionError:
+			pass
+		out = []
+		stack = [j]
+		while(stack):
+			j = stack.pop()
+			if(isinstance(j, str)):
+				out.append(j)
+				continue
+			children = j.get('children')
+			if(not children):
+				out.append(json.dumps(j))
+				continue
+			out.append(json.dumps({k: v for k, v in j.items() if k != 'children'})[:-1] + ', "children": [')
+			stack.append(']}')
+			for k, c in enumerate(reversed(children)):
+				if(k):
+					stack.append(', ')
+				stack.append(c)
+		return ''.join(out)
+
+
+	# json.loads() that also reads documents too deep for the json module, with a
+	# stack of the open objects and arrays and the key pending in each
+	@classmethod
+	def loads(_, s):
+		try:
+			return json.loads(s)
+		except RecursionError:
+			pass
+		if(isinstance(s, bytes)):
+			s = s.decode()
+		value = None
+		stack = []
+		for t in FCore.JSON_TOKENS.findall(s):
+			if(t == '{' or t == '['):
+				stack.append([{} if t == '{' else [], None])
+				continue
+			if(t == ':' or t == ','):
+				continue
+			if(t == '}' or t == ']'):
+				if(not stack):
+					raise ValueError('Invalid JSON document')
+				value = stack.pop()[0]
+			else:
+				value = json.loads(t)
+			if(not stack):
+				continue
+			top = stack[-1]
+			if(isinstance(top[0], list)):
+				top[0].append(value)
+			elif(top[1] is None):
+				top[1] = value
+			else:
+				top[0][top[1]] = value
+				top[1] = None
+		if(stack):
+			raise ValueError('Unterminated JSON document')
+		return value
@@ -0,0 +1,119 @@
+import os
+import struct
+import numpy as np
+
+from options import CURVE_FRAMES, CURVE_RESOLUTION
+
+
+# Writes wavetables to disk through a memory-mapped file, so an FPlan evaluates its
+# blocks of frames straight into the mapping and the table is never held in memory
+# next to its temporaries.  WAV and .f32 files hold little-endian 32-bit floats with
+# the frames concatenated, which is the layout wavetable synths import; .npy files
+# keep the (frames, resolution) shape and the table's dtype.
+class FExport:
+	FORMATS = ('wav', 'f32', 'npy')
+
+	SAMPLE_RATE = 44100
+
+	# RIFF header of a mono IEEE float WAV file with n samples
+	@classmethod
+	def wavHeader(_, n):
+		data = n * 4
+		if(data + 48 > 0xffffffff):
+			raise ValueError('Wavetable is too large for a WAV file')
+		return b''.join((
+			struct.pack('<4sI4s', b'RIFF', data + 48, b'WAVE'),
+			struct.pack('<4sIHHIIHH', b'fmt ', 16, 3, 1, FExport.SAMPLE_RATE, FExport.SAMPLE_RATE * 4, 4, 32),
+			struct.pack('<4sII', b'fact', 4, n),
+			struct.pack('<4sI', b'data', data)
+		))
+
+
+	@classmethod
+	def formatOf(_, path):
+		fmt = os.path.splitext(path)[1][1:].lower()
+		if(fmt not in FExport.FORMATS):
+			raise ValueError(f'Unknown export format "{fmt}", expected one of {", ".join(FExport.FORMATS)}')
+		return fmt
+
+
+	# Creates the file and returns a writable memory map of its samples with the given
+	# (frames, resolution) shape.  Flush and drop the map to finish the file.
+	@classmethod
+	def open(_, path, shape, dtype=np.float32):
+		fmt = FExport.formatOf(path)
+		if(fmt == 'npy'):
+			return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+		with open(path, 'wb') as f:
+			header = FExport.wavHeader(shape[0] * shape[1]) if fmt == 'wav' else b''
+			f.write(header)
+			f.truncate(len(header) + shape[0] * shape[1] * 4)
+		return np.memmap(path, '<f4', 'r+', len(header), shape)
+
+
+	# Evaluates plan into a new file at path, at resolution samples per frame.  Returns
+	# False and removes the file if isCancelled reported True during evaluation.
+	@classmethod
+	def export(_, plan, path, resolution=None, isCancelled=None):
+		out = FExport.open(path, (CURVE_FRAMES, resolution or CURVE_RESOLUTION), plan.dtype)
+		done = False
+		try:
+			with np.errstate(all='ignore'):
+				done = plan.execute(out=out, isCancelled=isCancelled, resolution=resolution) is not None
+			out.flush()
+		finally:
+			del out
+			if(not done):
+				os.remove(path)
+		return done
+
+
+	# Writes a table that has already been evaluated
+	@classmethod
+	def save(_, v, path):
+		out = FExport.open(path, v.shape, v.dtype)
+		np.copyto(out, v, casting='unsafe')
+		out.flush()
+		del out
+
+
+	# Octave mipmaps of a (frames, resolution) table: level 0 is the table itself and
+	# level k keeps the harmonics below resolution/2 >> k, so it plays without aliasing
+	# up to k octaves higher, down to the fundamental alone.  All
+	# frames go through one rfft and one irfft per level.  Levels keep the resolution
+	# of the table, or halve it per octave with shrink=True.  Non-finite samples are
+	# zeroed first, removeDC drops the offset of every frame and normalize scales all
+	# levels by the same factor so that the peak of level 0 is 1.
+	@classmethod
+	def mipmaps(_, v, levels=None, normalize=False, removeDC=False, shrink=False):
+		n = v.shape[1]
+		dtype = np.float32 if v.dtype == np.float32 else np.float64
+		v = np.nan_to_num(np.asarray(v, dtype), nan=0, posinf=0, neginf=0)
+		maxLevels = max(int(np.log2(n // 2)), 1) if n > 1 else 1
+		levels = min(levels or maxLevels, maxLevels)
+
+		spectrum = np.fft.rfft(v, axis=1)
+		if(removeDC):
+			spectrum[:, 0] = 0
+		mips = []
+		for k in range(levels):
+			size = n >> k if shrink else n
+			m = np.fft.irfft(spectrum[:, :n // 2 >> k] if k else spectrum, size, axis=1).astype(dtype, copy=False)
+			if(shrink and k):
+				m *= size / n
+			mips.append(m)
+
+		if(normalize):
+			peak = np.abs(mips[0]).max()
+			if(peak > 0):
+				for m in mips:
+					m /= peak
+		return mips
+
+
+	# Saves mipmaps as path with -0, -1... inserted before the extension
+	@classmethod
+	def saveMipmaps(_, mips, path):
+		base, ext = os.path.splitext(path)
+		for k, m in enumerate(mips):
+			FExport.save(m, f'{base}-{k}{ext}')
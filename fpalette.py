@@ -0,0 +1,160 @@
+import os
+
+from ftypes import FNodeType
+from fcore import FCore
+
+
+# Palette stored with a top-level index, so that opening it only reads the folder
+# tree and one entry per preset however large the presets are.
+#
+#   FPALETTE 1
+#   {"type": 999, "children": [{"type": 700, "name": "folder", "children": [...]}, ...]}
+#   {"type": 100, "name": "preset", "children": [...]}
+#   ...
+#
+# The second line is the palette in the FCore JSON format, with every preset that has
+# children cut down to a stub: the preset's own fields plus the offset and size of its
+# full JSON in the lines after the index, counted from the start of the third line.
+# Stubs are spliced in place with the preset's children by load() the first time a
+# view expands, drags or previews them, and written back unparsed by save().  Plain
+# JSON palettes are read as well, completely.
+class FPalette:
+	MAGIC = b'FPALETTE 1\n'
+
+	def __init__(self, path=None):
+		self.path = path
+		self.base = 0
+		self.root = FCore(FNodeType.ROOT)
+		# id of a stub to (stub, offset, size), the stub reference keeps the id from
+		# being reused while the entry exists
+		self.stubs = {}
+
+
+	@classmethod
+	def open(_, path) -> "FPalette":
+		palette = FPalette(path)
+		with open(path, 'rb') as f:
+			if(f.read(len(FPalette.MAGIC)) != FPalette.MAGIC):
+				f.seek(0)
+				palette.root = FCore.fromJSON(FCore.loads(f.read()))
+				return palette
+			palette.root = palette.fromIndex(FCore.loads(f.readline()))
+			palette.base = f.tell()
+		return palette
+
+
+	def fromIndex(self, j):
+		root = None
+		stack = [(j, None)]
+		while(stack):
+			j, p = stack.pop()
+			n = FCore.fromJSON({k: v for k, v in j.items() if k != 'children'})
+			if('offset' in j):
+				self.stubs[id(n)] = (n, j['offset'], j['size'])
+			if(p):
+				n._parent = p
+				p._children.append(n)
+			else:
+				root = n
+			stack.extend((c, n) for c in reversed(j.get('children') or []))
+		return root
+
+
+	def isStub(self, c):
+		return id(c) in self.stubs
+
+
+	def discard(self, c):
+		self.stubs.pop(id(c), None)
+
+
+	# Reads the presets of the stubs in one pass over the file and splices them in
+	def load(self, cores):
+		stubs = sorted((self.stubs.pop(id(c)) for c in cores if id(c) in self.stubs), key=lambda s: s[1])
+		if(not stubs):
+			return
+		with open(self.path, 'rb') as f:
+			for stub, offset, size in stubs:
+				f.seek(self.base + offset)
+				n = FCore.fromJSON(FCore.loads(f.read(size)))
+				for c in n._children:
+					c._parent = stub
+				stub._children = n._children
+				stub._touch()
+				if(stub._node):
+					stub._node.markDirty()
+
+
+	# Loads every stub in the subtree of c, e.g. before it is copied
+	def loadAll(self, c):
+		if(not self.stubs):
+			return
+		cores = []
+		stack = [c]
+		while(stack):
+			n = stack.pop()
+			if(id(n) in self.stubs):
+				cores.append(n)
+			elif(n._type == FNodeType.ROOT or n._type == FNodeType.SET):
+				stack.extend(n._children)
+		self.load(cores)
+
+
+	# Writes the palette in the indexed format, presets that were never loaded are
+	# copied from the old file as they are.  The file is replaced once complete.
+	def save(self, path=None):
+		path = path or self.path
+		blobs = []
+		offsets = {}
+		old = open(self.path, 'rb') if self.stubs else None
+		try:
+			# Preorder, so that the blobs follow each other in the order of their offsets
+			index = None
+			offset = 0
+			stack = [(self.root, None)]
+			while(stack):
+				c, siblings = stack.pop()
+				if(c._type == FNodeType.ROOT or c._type == FNodeType.SET):
+					j = {'type': int(c._type)}
+					if(c._name):
+						j['name'] = c._name
+					if(c._children):
+						j['children'] = []
+						stack.extend((cc, j['children']) for cc in reversed(c._children))
+				else:
+					stub = self.stubs.get(id(c))
+					j = c.asJSON()
+					blob = None
+					if(stub):
+						old.seek(self.base + stub[1])
+						blob = old.read(stub[2])
+					elif(c._children):
+						blob = FCore.dumps(j).encode()
+						del j['children']
+					if(blob is not None):
+						j['offset'] = offset
+						j['size'] = len(blob)
+						blobs.append(blob)
+						offsets[id(c)] = (c, offset, len(blob))
+						offset += len(blob) + 1
+				if(siblings is None):
+					index = j
+				else:
+					siblings.append(j)
+		finally:
+			if(old):
+				old.close()
+
+		index = FCore.dumps(index).encode()
+		tmp = path + '.tmp'
+		with open(tmp, 'wb') as f:
+			f.write(FPalette.MAGIC)
+			f.write(index + b'\n')
+			for blob in blobs:
+				f.write(blob + b'\n')
+		os.replace(tmp, path)
+
+		# Stubs now point into the new file
+		self.path = path
+		self.base = len(FPalette.MAGIC) + len(index) + 1
+		self.stubs = {k: v for k, v in offsets.items() if k in self.stubs}
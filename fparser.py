@@ -0,0 +1,170 @@
+import re
+
+from ftypes import FNodeType
+from fcore import FCore
+
+
+class FParseError(ValueError):
+	def __init__(self, message, pos):
+		super().__init__(f'{message} at position {pos}')
+		self.message = message
+		self.pos = pos
+
+
+# Single pass tokenizer and shunting-yard parser building FCore trees directly, in
+# time linear in the formula length.  Binary operators are n-ary: a left operand of
+# the same (not negated) operator is extended instead of nested, and so is a right
+# operand of + or *.  Comparisons always nest, since a left operand cannot be told
+# apart from a parenthesized one.  Functions take their arguments separated by commas.
+class FParser:
+	NUMBER = 0
+	NAME = 1
+	OPERATOR = 2
+	OPEN = 3
+	CLOSE = 4
+	COMMA = 5
+
+	ASSOCIATIVE = (FNodeType.ADD, FNodeType.MULTIPLY)
+	COMPARISONS = (FNodeType.EQUAL, FNodeType.NOT_EQUAL, FNodeType.LESS_THAN, FNodeType.LESS_EQ, FNodeType.GREATER_THAN, FNodeType.GREATER_EQ)
+
+	TOKEN_RE = re.compile(r'\s*((?:\d+\.?\d*|\.\d+)(?:e[+-]?\d+)?|[a-z][a-z0-9]*|==|!=|<=|>=|&&|\|\||\S)')
+
+	LEXICON = {}
+
+	# Yields (kind, value, position) tuples, the value being the float of a number and
+	# the FNodeType of names and operators
+	@classmethod
+	def tokenize(_, s):
+		lexicon = FParser.LEXICON or FParser.buildLexicon()
+		for m in FParser.TOKEN_RE.finditer(s.lower()):
+			text = m.group(1)
+			token = lexicon.get(text)
+			if(token):
+				yield (token[0], token[1], m.start(1))
+			elif(text[0].isdigit() or text[0] == '.'):
+				yield (FParser.NUMBER, float(text), m.start(1))
+			elif(text[0].isalpha()):
+				raise FParseError(f'Unknown name "{text}"', m.start(1))
+			else:
+				raise FParseError(f'Unexpected "{text}"', m.start(1))
+
+
+	# Token text to (kind, FNodeType) for everything but numbers
+	@classmethod
+	def buildLexicon(_):
+		for k, t in FCore.TOKENS.items():
+			if(k[0].isalpha()):
+				FParser.LEXICON[k] = (FParser.NAME, t)
+			elif(t in FCore.PRIORITY):
+				FParser.LEXICON[k] = (FParser.OPERATOR, t)
+		FParser.LEXICON['('] = (FParser.OPEN, FNodeType.OPEN_PAREN)
+		FParser.LEXICON[')'] = (FParser.CLOSE, FNodeType.CLOSE_PAREN)
+		FParser.LEXICON[','] = (FParser.COMMA, None)
+		return FParser.LEXICON
+
+
+	# Operator stack entries are [type, pos, argument count], the count is only used by
+	# parentheses and a function's opening parenthesis sits right above the function
+	@classmethod
+	def parse(_, s:str) -> FCore:
+		output = []
+		ops = []
+		expectOperand = True
+		functionPos = None
+
+		for kind, v, pos in FParser.tokenize(s):
+			if(functionPos is not None and kind != FParser.OPEN):
+				raise FParseError('Expected "(" after the function name', pos)
+			functionPos = None
+
+			if(expectOperand):
+				if(kind == FParser.NUMBER):
+					c = FCore(FNodeType.CONSTANT)
+					c._constant = v
+					output.append(c)
+					expectOperand = False
+				elif(kind == FParser.NAME and 200 <= v < 400):
+					ops.append([v, pos, 0])
+					functionPos = pos
+				elif(kind == FParser.NAME):
+					output.append(FCore(v))
+					expectOperand = False
+				elif(kind == FParser.OPEN):
+					ops.append([FNodeType.OPEN_PAREN, pos, 1])
+				elif(kind == FParser.OPERATOR and v == FNodeType.SUBTRACT):
+					ops.append([FNodeType.NEGATE, pos, 0])
+				else:
+					raise FParseError('Expected a value', pos)
+				continue
+
+			if(kind == FParser.OPERATOR):
+				p = FCore.PRIORITY[v]
+				while(ops and ops[-1][0] != FNodeType.OPEN_PAREN and FCore.PRIORITY[ops[-1][0]] >= p):
+					FParser._apply(output, ops.pop())
+				ops.append([v, pos, 0])
+				expectOperand = True
+			elif(kind == FParser.CLOSE or kind == FParser.COMMA):
+				while(ops and ops[-1][0] != FNodeType.OPEN_PAREN):
+					FParser._apply(output, ops.pop())
+				if(not ops):
+					raise FParseError('Unmatched ")"' if kind == FParser.CLOSE else 'Unexpected ","', pos)
+				isCall = len(ops) > 1 and 200 <= ops[-2][0] < 400
+				if(kind == FParser.COMMA):
+					if(not isCall):
+						raise FParseError('Unexpected ","', pos)
+					ops[-1][2] += 1
+					expectOperand = True
+					continue
+				argc = ops.pop()[2]
+				if(isCall):
+					FParser._call(output, ops.pop(), argc)
+				elif(argc > 1):
+					raise FParseError('Unexpected ","', pos)
+			else:
+				raise FParseError('Expected an operator', pos)
+
+		if(functionPos is not None):
+			raise FParseError('Expected "(" after the function name', len(s))
+		if(expectOperand):
+			raise FParseError('Unexpected end of formula' if s.strip() else 'Empty formula', len(s))
+		while(ops):
+			op = ops.pop()
+			if(op[0] == FNodeType.OPEN_PAREN):
+				raise FParseError('Unmatched "("', op[1])
+			FParser._apply(output, op)
+		return output[0]
+
+
+	@classmethod
+	def _apply(_, output, op):
+		t = op[0]
+		if(t == FNodeType.NEGATE):
+			return output[-1].negate()
+		# Nodes are fresh and formula-less, so children are linked without addChild()
+		b = output.pop()
+		a = output[-1]
+		if(a._type != t or a._negated or t in FParser.COMPARISONS):
+			n = output[-1] = FCore(t)
+			n._children.append(a)
+			a._parent = n
+			a = n
+		if(b._type == t and not b._negated and t in FParser.ASSOCIATIVE):
+			for c in b._children:
+				c._parent = a
+			a._children.extend(b._children)
+		else:
+			a._children.append(b)
+			b._parent = a
+
+
+	@classmethod
+	def _call(_, output, op, argc):
+		t = op[0]
+		if(200 <= t < 350 and argc != 1):
+			raise FParseError(f'{FNodeType(t).name.lower()} takes a single argument', op[1])
+		n = FCore(t)
+		n._children = output[len(output)-argc:]
+		for c in n._children:
+			c._parent = n
+		del output[len(output)-argc:]
+		output.append(n)
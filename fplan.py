@@ -0,0 +1,391 @@
+import os
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from options import CURVE_FRAMES, CURVE_RESOLUTION, CURVE_DTYPE, EVAL_CHUNK_BYTES, EVAL_THREADS
+from ftypes import FNodeType
+from ftree import FTree
+
+
+# Flat evaluation plan for a finished expression tree.  Each instruction writes into one
+# of a small pool of scratch registers (reused once their value has been consumed),
+# so a whole formula evaluates with a handful of buffers and numpy out= arguments
+# instead of one fresh array per node.
+class FPlan:
+	SHAPE = (CURVE_FRAMES, CURVE_RESOLUTION)
+
+	CONSTANTS = {
+		FNodeType.PI: np.pi,
+		FNodeType.E: np.e
+	}
+
+	AXES = (FNodeType.W, FNodeType.X, FNodeType.Y, FNodeType.Z)
+
+	UNARY_UFUNCS = {
+		FNodeType.SIN: np.sin,
+		FNodeType.COS: np.cos,
+		FNodeType.TAN: np.tan,
+		FNodeType.ASIN: np.arcsin,
+		FNodeType.ACOS: np.arccos,
+		FNodeType.ATAN: np.arctan,
+		FNodeType.SINH: np.sinh,
+		FNodeType.COSH: np.cosh,
+		FNodeType.TANH: np.tanh,
+		FNodeType.ASINH: np.arcsinh,
+		FNodeType.ACOSH: np.arccosh,
+		FNodeType.ATANH: np.arctanh,
+		FNodeType.LOG2: np.log2,
+		FNodeType.LOG10: np.log10,
+		FNodeType.LN: np.log,
+		FNodeType.SQRT: np.sqrt,
+		FNodeType.SIGN: np.sign,
+		FNodeType.RINT: np.rint,
+		FNodeType.ABS: np.abs,
+		FNodeType.NEGATE: np.negative
+	}
+
+	# Folded left to right over all operands, AVG is divided by the operand count after
+	NARY_UFUNCS = {
+		FNodeType.ADD: np.add,
+		FNodeType.SUBTRACT: np.subtract,
+		FNodeType.MULTIPLY: np.multiply,
+		FNodeType.DIVIDE: np.divide,
+		FNodeType.EXPONENT: np.power,
+		FNodeType.MIN: np.minimum,
+		FNodeType.MAX: np.maximum,
+		FNodeType.SUM: np.add,
+		FNodeType.AVG: np.add
+	}
+
+	# Folded from the left like the other operators, a<b<c is (a<b)<c, which is also
+	# what its formula parses back to
+	COMPARISON_UFUNCS = {
+		FNodeType.EQUAL: np.equal,
+		FNodeType.NOT_EQUAL: np.not_equal,
+		FNodeType.LESS_THAN: np.less,
+		FNodeType.LESS_EQ: np.less_equal,
+		FNodeType.GREATER_THAN: np.greater,
+		FNodeType.GREATER_EQ: np.greater_equal
+	}
+
+	# Any non-zero operand counts as true
+	LOGIC_UFUNCS = {
+		FNodeType.OR: np.logical_or,
+		FNodeType.AND: np.logical_and
+	}
+
+	# Operands only carry the axes they actually vary along, so a sub-expression of
+	# x alone is evaluated once per sample and only expanded to the full grid when it
+	# meets a y/z dependent term
+	SCALAR = 0
+	ALONG_RESOLUTION = 1
+	ALONG_FRAMES = 2
+	FULL = 3
+
+	AXIS_MASKS = {
+		FNodeType.W: ALONG_RESOLUTION,
+		FNodeType.X: ALONG_RESOLUTION,
+		FNodeType.Y: ALONG_FRAMES,
+		FNodeType.Z: ALONG_FRAMES
+	}
+
+	AXIS_VALUES = {}
+
+	# Full tables that vary along both axes are evaluated in blocks of frames on a
+	# shared thread pool, numpy releases the GIL inside the kernels
+	CHUNK_BYTES = EVAL_CHUNK_BYTES
+	THREADS = EVAL_THREADS or os.cpu_count() or 1
+	POOL = None
+	POOL_LOCK = threading.Lock()
+
+
+	def __init__(self, dtype=None):
+		self.dtype = np.dtype(dtype or CURVE_DTYPE)
+		self.instructions = []
+		self.inputs = [None] * len(FPlan.AXES)
+		self.inputMasks = [FPlan.AXIS_MASKS[t] for t in FPlan.AXES]
+		self.registerMasks = []
+		self.result = None
+		self.resultMask = FPlan.SCALAR
+		self.dag = []
+		self.nodeCount = 0
+		self._entries = {}
+		self._freeRegisters = {}
+		self._scratch = {}
+
+
+	def __repr__(self) -> str:
+		return f'FPlan ({len(self.instructions)} instructions, {len(self.registerMasks)} registers, {len(self.inputs)} inputs, {self.dedupRatio():0.2f}x dedup)'
+
+
+	def _addInput(self, v):
+		self.inputs.append(v)
+		self.inputMasks.append(FPlan.SCALAR)
+		return -len(self.inputs)
+
+
+	def _mask(self, a):
+		return self.registerMasks[a] if a >= 0 else self.inputMasks[-a - 1]
+
+
+	def _allocRegister(self, mask):
+		free = self._freeRegisters.get(mask)
+		if(free):
+			return free.pop()
+		self.registerMasks.append(mask)
+		return len(self.registerMasks) - 1
+
+
+	def _freeRegister(self, r):
+		if(r >= 0):
+			self._freeRegisters.setdefault(self.registerMasks[r], []).append(r)
+
+
+	# Hash-conses the tree into the plan's DAG, children before their parents.
+	# Structurally identical subtrees (same type, constant value, negation and ordered
+	# children) share a single entry, so they are evaluated once and their array is
+	# reused by every parent.
+	def _intern(self, tree):
+		types = tree.types.tolist()
+		constants = tree.constants.tolist()
+		negated = tree.negated.tolist()
+		sizes = tree.sizes.tolist()
+		nextSiblings = tree.nextSiblings.tolist()
+		self.nodeCount = len(types)
+		entries = [0] * len(types)
+
+		for i in range(len(types)-1, -1, -1):
+			t = types[i]
+			if(t == FNodeType.CONSTANT):
+				key = (t, constants[i])
+			elif(t in FPlan.CONSTANTS or t in FPlan.AXES):
+				key = (t, negated[i])
+			else:
+				args = []
+				c = i + 1 if sizes[i] > 1 else 0
+				while(c):
+					args.append(entries[c])
+					c = c + nextSiblings[c] if nextSiblings[c] else 0
+				if(not FTree.isValidChildCount(t, len(args))):
+					raise ValueError(f'{FNodeType(t).name} has an invalid number of children')
+				if(not FPlan.isEvaluable(t)):
+					raise ValueError(f'{FNodeType(t).name} cannot be evaluated')
+				key = (t, negated[i], tuple(args))
+
+			entry = self._entries.get(key)
+			if(entry is None):
+				entry = self._entries[key] = len(self.dag)
+				self.dag.append(key)
+			entries[i] = entry
+		return entries[0] if entries else None
+
+
+	def _emit(self):
+		uses = [0] * len(self.dag)
+		for key in self.dag:
+			if(len(key) == 3):
+				for i in key[2]:
+					uses[i] += 1
+
+		operands = []
+		for key in self.dag:
+			t = key[0]
+			if(t == FNodeType.CONSTANT):
+				operands.append(self._addInput(key[1]))
+				continue
+			if(t in FPlan.CONSTANTS):
+				operands.append(self._addInput(-FPlan.CONSTANTS[t] if key[1] else FPlan.CONSTANTS[t]))
+				continue
+			if(t in FPlan.AXES):
+				src = -FPlan.AXES.index(t) - 1
+				if(key[1]):
+					out = self._allocRegister(self._mask(src))
+					self.instructions.append((FNodeType.NEGATE, out, (src,), False))
+					src = out
+				operands.append(src)
+				continue
+
+			_, negated, ids = key
+			args = tuple(operands[i] for i in ids)
+			mask = 0
+			for a in args:
+				mask |= self._mask(a)
+
+			# The first operand's register can double as the output if this is its last
+			# use, later operands cannot
+			if(args[0] >= 0 and uses[ids[0]] == 1 and self.registerMasks[args[0]] == mask):
+				out = args[0]
+			else:
+				out = self._allocRegister(mask)
+			for i in ids:
+				uses[i] -= 1
+				if(not uses[i] and operands[i] != out):
+					self._freeRegister(operands[i])
+			self.instructions.append((t, out, args, negated))
+			operands.append(out)
+		return operands[-1]
+
+
+	# Number of tree nodes per unique subtree, 1.0 when nothing could be shared
+	def dedupRatio(self):
+		return self.nodeCount / len(self.dag) if self.dag else 1.0
+
+
+	def _finalize(self):
+		nRegs = len(self.registerMasks)
+		self.resultMask = self._mask(self.result)
+		resolve = lambda a: a if a >= 0 else nRegs - a - 1
+		self.instructions = [(op, out, tuple(resolve(a) for a in args), neg) for op, out, args, neg in self.instructions]
+		self.result = resolve(self.result)
+		self._entries = {}
+		self._freeRegisters = {}
+
+
+	# Runs the plan and returns the full (CURVE_FRAMES, CURVE_RESOLUTION) table, or only
+	# the given frame indices sampled at resolution points per frame.  With
+	# broadcast=True the result is returned as a read-only broadcast view instead of
+	# being expanded into a new array.  isCancelled is polled between instructions and
+	# makes execute() return None once it reports True.
+	def execute(self, out=None, broadcast=False, isCancelled=None, frames=None, resolution=None):
+		rows = self.chunkFrames(resolution)
+		if(frames is None and self.resultMask == FPlan.FULL and rows < CURVE_FRAMES):
+			return self._executeChunked(out, isCancelled, resolution, rows)
+		return self._execute(out, broadcast, isCancelled, frames, resolution)
+
+
+	# Frames per block, so that one intermediate of a block fits EVAL_CHUNK_BYTES while
+	# every thread still gets a block
+	def chunkFrames(self, resolution=None):
+		rows = FPlan.CHUNK_BYTES // ((resolution or CURVE_RESOLUTION) * self.dtype.itemsize)
+		return max(1, min(rows, -(-CURVE_FRAMES // FPlan.THREADS)))
+
+
+	# Every block writes straight into its rows of out, so only the scratch registers
+	# of the blocks in flight are allocated next to the table
+	def _executeChunked(self, out, isCancelled, resolution, rows):
+		if(out is None):
+			out = np.empty((CURVE_FRAMES, resolution or CURVE_RESOLUTION), self.dtype)
+		run = lambda a: self._execute(out[a:a+rows], False, isCancelled, range(a, min(a+rows, CURVE_FRAMES)), resolution)
+		starts = range(0, CURVE_FRAMES, rows)
+		if(FPlan.THREADS > 1):
+			results = list(FPlan.pool().map(run, starts))
+		else:
+			results = [run(a) for a in starts]
+		return None if any(r is None for r in results) else out
+
+
+	def _execute(self, out, broadcast, isCancelled, frames, resolution):
+		shape = (CURVE_FRAMES if frames is None else len(frames), resolution or CURVE_RESOLUTION)
+		nRegs = len(self.registerMasks)
+		# Registers are per thread, blocks of the same plan run concurrently
+		key = (threading.get_ident(), shape)
+		scratch = self._scratch.get(key)
+		if(scratch is None):
+			scratch = self._scratch[key] = [np.empty(FPlan.shapeOf(m, shape), self.dtype) for m in self.registerMasks]
+		slots = scratch.copy()
+		if(self.result < nRegs):
+			if(out is not None and self.resultMask == FPlan.FULL):
+				slots[self.result] = out
+			else:
+				slots[self.result] = np.empty(FPlan.shapeOf(self.resultMask, shape), self.dtype)
+		slots.extend(FPlan.axisValues(frames, resolution, self.dtype))
+		slots.extend(self.inputs[len(FPlan.AXES):])
+
+		for op, o, args, negated in self.instructions:
+			if(isCancelled and isCancelled()):
+				return None
+			o = slots[o]
+			a = [slots[i] for i in args]
+			FPlan.kernel(op, o, a)
+			if(negated):
+				np.negative(o, out=o)
+
+		res = slots[self.result]
+		if(res is out):
+			return out
+		if(out is None):
+			if(broadcast):
+				return np.broadcast_to(np.asarray(res, self.dtype), shape)
+			out = np.empty(shape, self.dtype)
+		np.copyto(out, res)
+		return out
+
+
+	# Created on first use, from whichever FEvaluator thread gets there first
+	@classmethod
+	def pool(_):
+		with FPlan.POOL_LOCK:
+			if(not FPlan.POOL):
+				FPlan.POOL = ThreadPoolExecutor(FPlan.THREADS, thread_name_prefix='FPlan')
+			return FPlan.POOL
+
+
+	# Writes op applied to args into o.  Every operator makes a single pass per operand
+	# and accumulates in place; boolean results are cast straight into o.  A single
+	# operand passes through unchanged, as its formula shows.
+	@classmethod
+	def kernel(_, op, o, args):
+		fn = FPlan.UNARY_UFUNCS.get(op)
+		if(fn):
+			return fn(args[0], out=o)
+
+		if(len(args) == 1):
+			return np.copyto(o, args[0])
+		fn = FPlan.COMPARISON_UFUNCS.get(op) or FPlan.LOGIC_UFUNCS.get(op) or FPlan.NARY_UFUNCS[op]
+		fn(args[0], args[1], out=o)
+		for a in args[2:]:
+			fn(o, a, out=o)
+		if(op == FNodeType.AVG):
+			np.divide(o, len(args), out=o)
+
+
+	# Evaluates a single operator outside of a plan
+	@classmethod
+	def apply(_, op, args):
+		o = np.empty(np.broadcast_shapes(*[np.shape(a) for a in args]))
+		FPlan.kernel(op, o, args)
+		return o if o.shape else float(o)
+
+
+	@classmethod
+	def isEvaluable(_, op):
+		return op in FPlan.UNARY_UFUNCS or op in FPlan.NARY_UFUNCS or op in FPlan.COMPARISON_UFUNCS or op in FPlan.LOGIC_UFUNCS
+
+
+	@classmethod
+	def shapeOf(_, mask, shape=SHAPE):
+		if(not mask):
+			return ()
+		return (shape[0] if mask & FPlan.ALONG_FRAMES else 1, shape[1] if mask & FPlan.ALONG_RESOLUTION else 1)
+
+
+	@classmethod
+	def axisValues(_, frames=None, resolution=None, dtype=None):
+		dtype = np.dtype(dtype or CURVE_DTYPE)
+		isDefault = frames is None and resolution is None
+		if(isDefault and dtype in FPlan.AXIS_VALUES):
+			return FPlan.AXIS_VALUES[dtype]
+		values = []
+		for t, lo in zip(FPlan.AXES, (0, -1, -1, 0)):
+			if(FPlan.AXIS_MASKS[t] == FPlan.ALONG_FRAMES):
+				v = np.linspace(lo, 1, CURVE_FRAMES, dtype=dtype)
+				v = (v if frames is None else v[frames]).reshape(-1, 1)
+			else:
+				v = np.linspace(lo, 1, resolution or CURVE_RESOLUTION, dtype=dtype).reshape(1, -1)
+			v.flags.writeable = False
+			values.append(v)
+		if(isDefault):
+			# Assigned in one step so plans executing on worker threads never see a partial list
+			FPlan.AXIS_VALUES[dtype] = values
+		return values
+
+
+	# Compiles an FTree, or any node with the FCore accessors after converting it
+	@classmethod
+	def compile(_, n, dtype=None) -> "FPlan":
+		plan = FPlan(dtype)
+		plan._intern(n if isinstance(n, FTree) else FTree.fromNode(n))
+		plan.result = plan._emit()
+		plan._finalize()
+		return plan
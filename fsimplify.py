@@ -0,0 +1,238 @@
+import numpy as np
+from itertools import chain
+
+from ftypes import FNodeType
+from fplan import FPlan
+
+
+# Immutable expression term used by the simplifier.  Exposes the same accessors as
+# FNode that FPlan.compile() relies on, so simplified terms can be compiled directly.
+class FTerm:
+	__slots__ = ('_type', '_value', '_negated', '_children', '_key')
+
+	def __init__(self, type, value=0, negated=False, children=()):
+		self._type = type
+		self._value = value
+		self._negated = negated
+		self._children = tuple(children)
+		self._key = None
+
+
+	def __repr__(self) -> str:
+		return f'FTerm({self.key()})'
+
+
+	def type(self):
+		return self._type
+
+	def value(self):
+		return self._value
+
+	def isNegated(self):
+		return self._negated
+
+	def children(self):
+		return self._children
+
+	def isConstant(self):
+		return self._type == FNodeType.CONSTANT
+
+	def hasValidChildren(self):
+		if(self._type < 100):
+			return len(self._children) == 0
+		if(200 <= self._type < 350):
+			return len(self._children) == 1
+		return len(self._children) > 0
+
+
+	# Structural key, also used to canonicalize the operand order of commutative ops.
+	# It is flat, the type, value, negation and child count of every node in preorder,
+	# so that hashing and comparing the keys of deep terms does not recurse.  Keys of
+	# the subterms are built first, from an explicit stack.
+	def key(self):
+		if(self._key is None):
+			order = []
+			stack = [self]
+			while(stack):
+				t = stack.pop()
+				if(t._key is None):
+					order.append(t)
+					stack.extend(t._children)
+			for t in reversed(order):
+				t._key = tuple(chain((int(t._type), float(t._value), t._negated, len(t._children)), *(c._key for c in t._children)))
+		return self._key
+
+
+	def negated(self):
+		if(self.isConstant()):
+			return FTerm(FNodeType.CONSTANT, -self._value)
+		return FTerm(self._type, self._value, not self._negated, self._children)
+
+
+	def asJSON(self):
+		out = []
+		stack = [(self, out)]
+		while(stack):
+			t, siblings = stack.pop()
+			j = {'type': int(t._type)}
+			if(t.isConstant()):
+				j['value'] = int(t._value) if not t._value % 1 else t._value
+			elif(t._negated):
+				j['negated'] = True
+			siblings.append(j)
+			if(t._children):
+				j['children'] = []
+				stack.extend((c, j['children']) for c in reversed(t._children))
+		return out[0]
+
+
+	# Works on anything with the FCore accessors.  Nodes are listed breadth first with
+	# the index of their parent and turned into terms in reverse, so every node's
+	# children are done before it without recursing.
+	@classmethod
+	def fromNode(_, n) -> "FTerm":
+		nodes = [(n, -1)]
+		i = 0
+		while(i < len(nodes)):
+			c = nodes[i][0]
+			if(c.type() != FNodeType.CONSTANT):
+				nodes.extend((cc, i) for cc in c.children())
+			i += 1
+		children = [[] for _ in nodes]
+		for i in range(len(nodes) - 1, -1, -1):
+			c, p = nodes[i]
+			if(c.type() == FNodeType.CONSTANT):
+				t = FTerm(FNodeType.CONSTANT, float(c.value()))
+			else:
+				t = FTerm(c.type(), 0, c.isNegated(), reversed(children[i]))
+			if(p < 0):
+				return t
+			children[p].append(t)
+
+
+# Constant folding and algebraic simplification of expression trees.  Constant-only
+# subtrees (including pi and e) are folded, identity and annihilator operands are
+# dropped, nested ADD/MULTIPLY are flattened and commutative operands are sorted so
+# that equivalent sub-expressions become structurally identical.
+class FSimplifier:
+	FOLDED_CONSTANTS = {
+		FNodeType.PI: np.pi,
+		FNodeType.E: np.e
+	}
+
+	COMMUTATIVE = (FNodeType.ADD, FNodeType.MULTIPLY)
+
+	# Operands are simplified before their operator, in reverse breadth first order
+	# like FTerm.fromNode(), so deep trees do not hit the recursion limit.  Operators
+	# with an invalid number of operands are kept as they are.
+	@classmethod
+	def simplify(_, n) -> FTerm:
+		t = n if isinstance(n, FTerm) else FTerm.fromNode(n)
+		terms = [(t, -1)]
+		i = 0
+		while(i < len(terms)):
+			c = terms[i][0]
+			if(c.children() and c.hasValidChildren()):
+				terms.extend((cc, i) for cc in c.children())
+			i += 1
+		operands = [[] for _ in terms]
+		for i in range(len(terms) - 1, -1, -1):
+			c, p = terms[i]
+			if(operands[i]):
+				c = FSimplifier._simplify(c, operands[i][::-1])
+			if(p < 0):
+				return c
+			operands[p].append(c)
+
+
+	@classmethod
+	def constantValue(_, t):
+		if(t.isConstant()):
+			return t.value()
+		v = FSimplifier.FOLDED_CONSTANTS.get(t.type())
+		if(v is not None and t.isNegated()):
+			return -v
+		return v
+
+
+	@classmethod
+	def fold(_, t, values):
+		if(not FPlan.isEvaluable(t.type())):
+			return None
+		with np.errstate(all='ignore'):
+			v = FPlan.apply(t.type(), [np.float64(v) for v in values])
+		if(not np.isfinite(v)):
+			return None
+		return -v if t.isNegated() else v
+
+
+	# Simplifies the operator t given its simplified operands
+	@classmethod
+	def _simplify(_, t, children):
+		op = t.type()
+		negated = t.isNegated()
+
+		if(op in FSimplifier.COMMUTATIVE):
+			flat = []
+			for c in children:
+				if(c.type() != op):
+					flat.append(c)
+				elif(not c.isNegated()):
+					flat.extend(c.children())
+				elif(op == FNodeType.ADD):
+					flat.extend(gc.negated() for gc in c.children())
+				else:
+					flat.extend(c.children())
+					negated = not negated
+			children = flat
+
+		values = [FSimplifier.constantValue(c) for c in children]
+		if(all(v is not None for v in values)):
+			v = FSimplifier.fold(FTerm(op, 0, negated, children), values)
+			if(v is not None):
+				return FTerm(FNodeType.CONSTANT, v)
+
+		match(op):
+			case FNodeType.ADD | FNodeType.MULTIPLY:
+				identity = 0 if op == FNodeType.ADD else 1
+				constants = [v for v in values if v is not None]
+				folded = FSimplifier.fold(FTerm(op), constants) if constants else identity
+				if(folded is None):
+					# Folding overflowed, the constant operands are kept as they are
+					folded = identity
+				else:
+					children = [c for c, v in zip(children, values) if v is None]
+				if(op == FNodeType.MULTIPLY and folded == 0):
+					return FTerm(FNodeType.CONSTANT, 0)
+				if(op == FNodeType.MULTIPLY and folded == -1):
+					negated = not negated
+				elif(folded != identity):
+					children.append(FTerm(FNodeType.CONSTANT, folded))
+				children.sort(key=FSimplifier.sortKey)
+			case FNodeType.SUBTRACT | FNodeType.DIVIDE:
+				identity = 0 if op == FNodeType.SUBTRACT else 1
+				children = children[:1] + [c for c in children[1:] if FSimplifier.constantValue(c) != identity]
+				if(op == FNodeType.SUBTRACT and len(children) == 2 and FSimplifier.constantValue(children[0]) == 0):
+					return FSimplifier.withNegation(children[1].negated(), negated)
+			case FNodeType.EXPONENT:
+				rest = [FSimplifier.constantValue(c) for c in children[1:]]
+				if(0 in rest):
+					return FTerm(FNodeType.CONSTANT, -1 if negated else 1)
+				children = children[:1] + [c for c, v in zip(children[1:], rest) if v != 1]
+
+		if(not children):
+			return FSimplifier.withNegation(FTerm(FNodeType.CONSTANT, 0 if op == FNodeType.ADD else 1), negated)
+		if(len(children) == 1 and (op in FPlan.NARY_UFUNCS or op in FPlan.COMPARISON_UFUNCS or op in FPlan.LOGIC_UFUNCS)):
+			return FSimplifier.withNegation(children[0], negated)
+		return FTerm(op, 0, negated, children)
+
+
+	@classmethod
+	def withNegation(_, t, negated):
+		return t.negated() if negated else t
+
+
+	# Variable operands first, constants last, otherwise by structure
+	@classmethod
+	def sortKey(_, t):
+		return (t.isConstant(), t.key())
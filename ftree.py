@@ -0,0 +1,250 @@
+import numpy as np
+
+from ftypes import FNodeType
+from fcore import FCore
+
+
+# Whole expression tree stored as parallel arrays, one entry per node in preorder,
+# so the subtree of node i is the slice [i, i+sizes[i]).  Parent and next sibling
+# links are offsets relative to the node (0 for none), which keeps any slice a valid
+# tree on its own; the first child of a node with sizes[i] > 1 is always i+1.
+class FTree:
+	def __init__(self, n=0):
+		self.types = np.zeros(n, np.int16)
+		self.parentOffsets = np.zeros(n, np.int32)
+		self.nextSiblings = np.zeros(n, np.int32)
+		self.sizes = np.ones(n, np.int32)
+		self.constants = np.zeros(n, np.float64)
+		self.negated = np.zeros(n, np.bool_)
+		self.names = np.full(n, None, object)
+
+
+	def __repr__(self) -> str:
+		return f'FTree ({len(self)} nodes)'
+
+
+	def __len__(self):
+		return len(self.types)
+
+
+	def _arrays(self):
+		return (self.types, self.parentOffsets, self.nextSiblings, self.sizes, self.constants, self.negated, self.names)
+
+
+	def _setArrays(self, arrays):
+		self.types, self.parentOffsets, self.nextSiblings, self.sizes, self.constants, self.negated, self.names = arrays
+
+
+	def type(self, i=0):
+		return FNodeType(self.types[i])
+
+
+	def parent(self, i):
+		return i - int(self.parentOffsets[i]) if i > 0 else -1
+
+
+	def firstChild(self, i):
+		return i + 1 if self.sizes[i] > 1 else -1
+
+
+	def nextSibling(self, i):
+		s = int(self.nextSiblings[i])
+		return i + s if s and i > 0 else -1
+
+
+	def children(self, i=0):
+		c = self.firstChild(i)
+		while(c >= 0):
+			yield c
+			c = self.nextSibling(c)
+
+
+	# Slice holding the subtree of node i.  It shares memory with this tree, copy()
+	# it before editing either of them.
+	def subtree(self, i) -> "FTree":
+		t = FTree()
+		end = i + int(self.sizes[i])
+		t._setArrays([a[i:end] for a in self._arrays()])
+		return t
+
+
+	def copy(self) -> "FTree":
+		t = FTree()
+		t._setArrays([a.copy() for a in self._arrays()])
+		if(len(t)):
+			t.parentOffsets[0] = t.nextSiblings[0] = 0
+		return t
+
+
+	# Removes the subtrees of the given nodes, all at once in a few vectorized passes
+	def delete(self, *indices):
+		keep = np.ones(len(self), np.bool_)
+		for i in indices:
+			assert i > 0, 'the root cannot be deleted'
+			keep[i:i + self.sizes[i]] = False
+		# kept[i] is the number of kept nodes before i, i.e. the new index of node i
+		kept = np.concatenate(([0], np.cumsum(keep))).astype(np.int32)
+		idx = np.arange(len(self))
+		parents = idx - self.parentOffsets
+		sizes = kept[idx + self.sizes] - kept[idx]
+		self._setArrays([a[keep] for a in self._arrays()])
+		self.sizes = sizes[keep]
+		self.parentOffsets = kept[:-1][keep] - kept[parents[keep]]
+		self._relink()
+
+
+	# Recomputes the next sibling links from the parents and subtree sizes
+	def _relink(self):
+		idx = np.arange(len(self))
+		parents = idx - self.parentOffsets
+		ends = parents + self.sizes[parents]
+		self.nextSiblings = np.where(idx + self.sizes < ends, self.sizes, 0).astype(np.int32)
+		if(len(self)):
+			self.nextSiblings[0] = 0
+
+
+	# Inserts a copy of tree as child idx (by default the last child) of node p
+	def insert(self, p, tree, idx=None):
+		kids = list(self.children(p))
+		idx = len(kids) if idx is None else idx
+		at = kids[idx] if idx < len(kids) else p + int(self.sizes[p])
+		size = len(tree)
+
+		tail = np.arange(at, len(self))
+		moved = tail - self.parentOffsets[at:] < at
+		self.parentOffsets[at:][moved] += size
+		a = p
+		while(a >= 0):
+			self.sizes[a] += size
+			if(self.nextSiblings[a] and a > 0):
+				self.nextSiblings[a] += size
+			a = self.parent(a)
+		if(idx == len(kids) and kids):
+			self.nextSiblings[kids[-1]] = self.sizes[kids[-1]]
+
+		self._setArrays([np.concatenate((a[:at], b, a[at:])) for a, b in zip(self._arrays(), tree._arrays())])
+		self.parentOffsets[at] = at - p
+		self.nextSiblings[at] = size if idx < len(kids) else 0
+
+
+	def previousSibling(self, i):
+		prev = -1
+		for c in self.children(self.parent(i)):
+			if(c == i):
+				return prev
+			prev = c
+		return -1
+
+
+	def hasValidChildren(self, i=0):
+		return FTree.isValidChildCount(self.types[i], sum(1 for _ in self.children(i)))
+
+
+	@classmethod
+	def isValidChildCount(_, t, count):
+		if(t < 100):
+			return count == 0
+		if(200 <= t < 350):
+			return count == 1
+		return count > 0
+
+
+	# Builds the arrays from preorder records of (type, constant, negated, name) and
+	# the index of each record's parent
+	@classmethod
+	def _fromRecords(_, records, parents) -> "FTree":
+		n = len(records)
+		t = FTree(n)
+		if(not n):
+			return t
+		types, constants, negated, names = zip(*records)
+		t.types[:] = types
+		t.constants[:] = constants
+		t.negated[:] = negated
+		t.names[:] = names
+
+		sizes = [1] * n
+		for i in range(n-1, 0, -1):
+			sizes[parents[i]] += sizes[i]
+		t.sizes[:] = sizes
+		t.parentOffsets[:] = np.arange(n) - np.array(parents, np.int32)
+		t.parentOffsets[0] = 0
+		t._relink()
+		return t
+
+
+	# Works on anything with the FCore accessors (FCore, FTerm or FNode)
+	@classmethod
+	def fromNode(_, root) -> "FTree":
+		records = []
+		parents = []
+		stack = [(root, -1)]
+		while(stack):
+			n, p = stack.pop()
+			t = n.type()
+			isConstant = t == FNodeType.CONSTANT
+			name = n.name() if hasattr(n, 'name') else None
+			records.append((t, n.value() if isConstant else 0, False if isConstant else n.isNegated(), name))
+			parents.append(p)
+			i = len(records) - 1
+			stack.extend((c, i) for c in reversed(n.children()))
+		return FTree._fromRecords(records, parents)
+
+
+	@classmethod
+	def fromJSON(_, j) -> "FTree":
+		records = []
+		parents = []
+		stack = [(j, -1)]
+		while(stack):
+			n, p = stack.pop()
+			records.append((n['type'], n.get('value') or 0, bool(n.get('negated')), n.get('name')))
+			parents.append(p)
+			i = len(records) - 1
+			stack.extend((c, i) for c in reversed(n.get('children') or []))
+		return FTree._fromRecords(records, parents)
+
+
+	# Same layout as FNode.asJSON(stringify=False)
+	def asJSON(self, i=0):
+		out = []
+		stack = [(i, out)]
+		while(stack):
+			i, siblings = stack.pop()
+			t = int(self.types[i])
+			j = {'type': t}
+			if(self.names[i]):
+				j['name'] = self.names[i]
+			if(t == FNodeType.CONSTANT):
+				v = float(self.constants[i])
+				j['value'] = int(v) if not v % 1 else v
+			elif(self.negated[i]):
+				j['negated'] = True
+			siblings.append(j)
+			children = list(self.children(i))
+			if(children):
+				j['children'] = []
+				stack.extend((c, j['children']) for c in reversed(children))
+		return out[0]
+
+
+	def toCore(self, i=0) -> FCore:
+		end = i + int(self.sizes[i])
+		types = self.types[i:end].tolist()
+		constants = self.constants[i:end].tolist()
+		negated = self.negated[i:end].tolist()
+		offsets = self.parentOffsets[i:end].tolist()
+		cores = []
+		for k in range(end - i):
+			c = FCore(FNodeType(types[k]))
+			c._name = self.names[i+k]
+			if(types[k] == FNodeType.CONSTANT):
+				c.setConstantValue(constants[k])
+			else:
+				c._negated = negated[k]
+			if(k):
+				p = cores[k - offsets[k]]
+				c._parent = p
+				p._children.append(c)
+			cores.append(c)
+		return cores[0]
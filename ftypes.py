@@ -0,0 +1,54 @@
+from enum import IntEnum
+
+
+class FNodeType(IntEnum):
+	CONSTANT = 0
+	W = 10
+	X = 11
+	Y = 12
+	Z = 13
+	PI = 50
+	E = 51
+	ADD = 100
+	SUBTRACT = 101
+	MULTIPLY = 102
+	DIVIDE = 103
+	EXPONENT = 104
+	EQUAL = 105
+	NOT_EQUAL = 106
+	LESS_THAN = 107
+	LESS_EQ = 108
+	GREATER_THAN = 109
+	GREATER_EQ = 110
+	OR = 111
+	AND = 112
+	SIN = 200
+	COS = 201
+	TAN = 202
+	ASIN = 203
+	ACOS = 204
+	ATAN = 205
+	SINH = 206
+	COSH = 207
+	TANH = 208
+	ASINH = 209
+	ACOSH = 210
+	ATANH = 211
+	LOG2 = 300
+	LOG10 = 301
+	LN = 302
+	SQRT = 303
+	SIGN = 304
+	RINT = 305
+	ABS = 306
+	MIN = 350
+	MAX = 351
+	SUM = 352
+	AVG = 353
+	NEGATE = 400
+	OPEN_PAREN = 500
+	CLOSE_PAREN = 501
+	VARIABLE = 600
+	SET = 700
+	FUNCTION = 800
+	ROOT = 999
@@ -0,0 +1,193 @@
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+import numpy as np
+
+from options import CURVE_RESOLUTION
+from fexport import FExport
+
+
+# Evaluates a plan progressively: the requested frame at preview width, the same
+# frame at full resolution and finally (for full jobs) the whole wavetable
+class FEvalJob(QRunnable):
+	def __init__(self, evaluator, node, generation, plan, frame=None, width=None, full=True):
+		super().__init__()
+		self.setAutoDelete(False)
+		self.evaluator = evaluator
+		self.node = node
+		self.nodeID = node.nodeID()
+		self.generation = generation
+		self.plan = plan
+		self.frame = frame
+		self.full = full
+		self.cancelled = False
+
+		self.stages = []
+		if(frame is not None):
+			if(width and width < CURVE_RESOLUTION):
+				self.stages.append((frame, width))
+			self.stages.append((frame, None))
+		if(full):
+			self.stages.append((None, None))
+
+
+	def key(self):
+		return (self.nodeID, self.full)
+
+
+	def cancel(self):
+		self.cancelled = True
+
+
+	def run(self):
+		for i, (frame, width) in enumerate(self.stages):
+			if(self.cancelled):
+				return
+			try:
+				v = self.plan.execute(
+					broadcast=frame is None,
+					isCancelled=lambda: self.cancelled,
+					frames=None if frame is None else (frame,),
+					resolution=width)
+			except Exception as e:
+				print(f'Evaluation of #{self.nodeID} failed: {e}')
+				return
+			if(v is None or self.cancelled):
+				return
+			self.evaluator.jobProgressed.emit(self, frame, v, i == len(self.stages)-1)
+
+
+# Writes a wavetable, or its mipmaps, to a file.  The table is evaluated from the plan
+# unless it is given, plain tables straight into the file.
+class FExportJob(QRunnable):
+	def __init__(self, evaluator, plan, path, mipmaps=False, table=None):
+		super().__init__()
+		self.setAutoDelete(False)
+		self.evaluator = evaluator
+		self.plan = plan
+		self.path = path
+		self.mipmaps = mipmaps
+		self.table = table
+		self.cancelled = False
+
+
+	def cancel(self):
+		self.cancelled = True
+
+
+	def run(self):
+		done = False
+		error = None
+		try:
+			v = self.table
+			if(self.mipmaps):
+				if(v is None):
+					with np.errstate(all='ignore'):
+						v = self.plan.execute(isCancelled=lambda: self.cancelled)
+				if(v is not None and not self.cancelled):
+					FExport.saveMipmaps(FExport.mipmaps(v, normalize=True, removeDC=True), self.path)
+					done = True
+			elif(v is not None):
+				FExport.save(v, self.path)
+				done = True
+			else:
+				done = FExport.export(self.plan, self.path, isCancelled=lambda: self.cancelled)
+		except (ValueError, OSError) as e:
+			error = str(e)
+		self.evaluator.exportFinished.emit(self, done, error)
+
+
+# Evaluates node values on a thread pool.  The tree is snapshotted into an FPlan on
+# the GUI thread, so workers never touch the nodes themselves; results are handed
+# back to the GUI thread and announced through the node's nodeStateChanged signal.
+class FEvaluator(QObject):
+	INSTANCE = None
+
+	jobProgressed = pyqtSignal(object, object, object, bool)
+	# job, whether the file was written and the error message if it failed
+	exportFinished = pyqtSignal(object, bool, object)
+
+	def __init__(self):
+		super().__init__()
+		self.pool = QThreadPool()
+		self.pending = {}
+		self.exports = set()
+		self.jobProgressed.connect(self.onJobProgressed)
+		self.exportFinished.connect(lambda job, *_: self.exports.discard(job))
+
+
+	# Starts (or keeps) a full evaluation of the node.  If a frame is given it is
+	# evaluated first, and frames requested while a full job is already running get a
+	# separate, short frame-only job that shares the full job's plan.
+	def submit(self, n, frame=None, width=None):
+		nodeID = n.nodeID()
+		job = self.pending.get((nodeID, True))
+		if(job and job.generation != n.generation()):
+			job = None
+		if(not job):
+			self.cancel(nodeID)
+		try:
+			plan = job.plan if job else n.plan()
+		except ValueError as e:
+			print(f'{n} - {e}')
+			return
+		if(not job):
+			return self._start(FEvalJob(self, n, n.generation(), plan, frame, width))
+
+		if(frame is None or frame == job.frame or n.previewValue(frame) is not None):
+			return
+		job = self.pending.get((nodeID, False))
+		if(job and job.frame == frame):
+			return
+		self._cancelJob((nodeID, False))
+		self._start(FEvalJob(self, n, n.generation(), plan, frame, width, full=False))
+
+
+	def _start(self, job):
+		self.pending[job.key()] = job
+		self.pool.start(job)
+
+
+	def _cancelJob(self, key):
+		job = self.pending.pop(key, None)
+		if(job):
+			job.cancel()
+			self.pool.tryTake(job)
+
+
+	# Supersedes any queued or running job for the node
+	def cancel(self, nodeID):
+		self._cancelJob((nodeID, True))
+		self._cancelJob((nodeID, False))
+
+
+	def onJobProgressed(self, job, frame, v, final):
+		if(self.pending.get(job.key()) is not job):
+			return
+		if(final):
+			del self.pending[job.key()]
+		if(job.node.generation() != job.generation):
+			return
+		if(frame is None):
+			self._cancelJob((job.nodeID, False))
+			job.node.setEvaluatedValue(v)
+		else:
+			job.node.setPreviewValue(frame, v[0])
+
+
+	# Starts writing the table of plan, or the given table, to path.  exportFinished is
+	# emitted on the GUI thread when it is done.
+	def export(self, plan, path, mipmaps=False, table=None):
+		job = FExportJob(self, plan, path, mipmaps, table)
+		self.exports.add(job)
+		self.pool.start(job)
+		return job
+
+
+	def waitForDone(self, msecs=-1):
+		return self.pool.waitForDone(msecs)
+
+
+	@classmethod
+	def instance(_):
+		if(not FEvaluator.INSTANCE):
+			FEvaluator.INSTANCE = FEvaluator()
+		return FEvaluator.INSTANCE
@@ -1,188 +1,180 @@
-import sys
-from PyQt6.QtWidgets import *
-from PyQt6.QtGui import *
-from PyQt6.QtCore import *
-import numpy as np
-from fnode import FNode, FNodeType
-from node_view import NodeView
-from preview_panel import PreviewPanel
-
-from options import CURVE_FRAMES, CURVE_RESOLUTION
-from stylesheets import *
-
-
-class NodePalette(NodeView):
-	def __init__(self, rootNode):
-		super().__init__()
-		self.rootNode = rootNode
-		self.defaultNodeIDs = set()
-		self.createTreeItems(self.rootNode)
-		self.invisibleRootItem().setFlags(self.invisibleRootItem().flags() &  ~Qt.ItemFlag.ItemIsDropEnabled)
-
-
-	def dragEnterEvent(self, e):
-		return e.ignore()
-	
-
-	def createItem(self, n):
-		tItem = super().createItem(n)
-		tItem.setFlags(tItem.flags() &  ~(Qt.ItemFlag.ItemIsDropEnabled | Qt.ItemFlag.ItemIsEditable))
-		if(n.type() == FNodeType.SET):
-			tItem.setFlags(tItem.flags() &  ~Qt.ItemFlag.ItemIsDragEnabled)
-		self.defaultNodeIDs.add(tItem.data(0, Qt.ItemDataRole.UserRole))
-		return tItem
-
-
-	def deleteSelectedItem(self):
-		return False
-
-
-	def onQuickButtonPressed(self, b, tItem, e):
-		prevSelection = self.selectedItem()
-		prevTopItem = self.itemAt(0, 0)
-		self.clearSelection()
-		self.scrollToItem(tItem, QAbstractItemView.ScrollHint.EnsureVisible)
-		p = self.visualItemRect(tItem).topLeft()
-		mpe = QMouseEvent(QEvent.Type.MouseButtonPress, e.position()+QPointF(p), Qt.MouseButton.LeftButton, Qt.MouseButton.NoButton, Qt.KeyboardModifier.NoModifier)
-		self.mousePressEvent(mpe)
-		self.startDrag(Qt.DropAction.CopyAction)
-		self.scrollToItem(prevTopItem, QAbstractItemView.ScrollHint.EnsureVisible)
-		self.clearSelection()
-		if(prevSelection):
-			prevSelection.setSelected(True)
-
-
-class MainExpressionTree(NodeView):
-	def __init__(self):
-		super().__init__()
-		self.setStyleSheet(COMPOSITION_VIEW_STYLE)
-	
-	def dropEvent(self, e: QDropEvent):
-		super().dropEvent(e)
-		if(e.source() != self):
-			tItem = e.source().lastDraggedItem
-			n = self.attachedNode(tItem)
-			if(n.type() == FNodeType.CONSTANT):
-				self.pauseItemUpdates = True
-				tItem.setText(0, '0')
-				self.pauseItemUpdates = False
-				self.editItem(tItem, 0)
-
-
-class UserPalette(NodeView):
-	def __init__(self, rootNode):
-		super().__init__()
-		self.rootNode = rootNode
-		self.defaultNodeIDs = set()
-		self.isAddingDefaults = True
-		if(self.rootNode):
-			self.createTreeItems(self.rootNode)
-
-	
-	def contextMenuEvent(self, e: QContextMenuEvent) -> None:
-		tItem = self.itemAt(e.pos())
-		m = QMenu()
-		aNewFolder = QAction('New Folder')
-		aRename = QAction('Rename')
-		aDelete = QAction('Delete')
-
-		m.addAction(aNewFolder)
-		if(tItem):
-			m.addAction(aRename)
-			m.addAction(aDelete)
-		a = m.exec(self.mapToGlobal(e.pos()))
-
-		return super().contextMenuEvent(e)
-	
-
-	def mousePressEvent(self, e: QMouseEvent) -> None:
-		return super().mousePressEvent(e)
-
-
-
-class CompositionPanel(QFrame):
-	def __init__(self, defaultRootNode, userRootNode=None):
-		super().__init__()
-		self.nodePalette = NodePalette(defaultRootNode)
-		self.userPalette = UserPalette(userRootNode)
-		self.expTree = MainExpressionTree()
-
-		self.quickButtons = {}
-		for bLabel, tLabel in [('w', 'w'), ('x', 'x'), ('y', 'y'), ('z', 'z'), ('123', 'constant value'), ('+', 'plus'), ('-', 'minus'), ('*', 'multiply'), ('÷', 'divide'), ('^', 'exponential'), ('sin', 'sin')]:
-			tItem = self.nodePalette.findItems(tLabel, Qt.MatchFlag.MatchExactly | Qt.MatchFlag.MatchRecursive, 0)[0]
-			b = QPushButton(bLabel)
-			b.setStyleSheet(QUICK_BUTTON_STYLE)
-			b.mousePressEvent = lambda e, b=b, tItem=tItem: self.nodePalette.onQuickButtonPressed(b, tItem, e)
-			self.quickButtons[bLabel] = b
-
-
-		v = QVBoxLayout()
-
-		h = QHBoxLayout()
-		[h.addWidget(b) for b in self.quickButtons.values()]
-		v.addLayout(h)
-
-		h = QHBoxLayout()
-		tabs = QTabWidget()
-		tabs.addTab(self.nodePalette, 'Base Palette')
-		tabs.addTab(self.userPalette, 'User Palette')
-		h.addWidget(tabs)
-		h.addWidget(self.expTree, 1)
-		v.addLayout(h)
-
-		self.setLayout(v)
-
-
-	def keyPressEvent(self, e):
-		if(e.key() == Qt.Key.Key_B and e.modifiers() & Qt.KeyboardModifier.ControlModifier):
-			pass
-
-
-class Application(QApplication):
-	def __init__(self, *args, **kwargs):
-		super(Application, self).__init__(*args, **kwargs)
-
-		try:
-			with open('default_palette.json') as f:
-				s = ''.join(f.readlines())
-				f.close()
-			defaultRootNode = FNode.fromString(s)
-			assert defaultRootNode
-		except Exception as e:
-			print('Failed to open default_palette.json!')
-			exit(1)
-
-		try:
-			with open('user_palette.json') as f:
-				s = ''.join(f.readlines())
-				f.close()
-			userRootNode = FNode.fromString(s)
-			assert userRootNode
-		except Exception as e:
-			print('Failed to open user_palette.json!')
-			userRootNode = None
-
-		self.compositionPanel = CompositionPanel(defaultRootNode, userRootNode)
-		self.previewPanel = PreviewPanel(self.compositionPanel.expTree)
-
-		v = QVBoxLayout()
-		v.addWidget(self.previewPanel)
-		v.addWidget(self.compositionPanel, 1)
-
-		f = QFrame()
-		f.setLayout(v)
-		self.mainWin = QMainWindow()
-		self.mainWin.setCentralWidget(f)
-		self.mainWin.setWindowTitle('Function Designer')
-		self.mainWin.setGeometry(0, 0, 600, 800)
-		self.mainWin.show()
-
-		self.previewPanel.previewFormula.setText('1+2*3*4+5+6')
-
-		self.exec()
-
-if __name__ == '__main__':
-	Application(sys.argv)
-
-	
-	
+import sys
+import os
+from PyQt6.QtWidgets import *
+from PyQt6.QtGui import *
+from PyQt6.QtCore import *
+import numpy as np
+from fnode import FNode, FNodeType
+from fpalette import FPalette
+from node_view import NodeView
+from preview_panel import PreviewPanel
+
+from options import CURVE_FRAMES, CURVE_RESOLUTION, USER_PALETTE
+from stylesheets import *
+
+
+class NodePalette(NodeView):
+	def __init__(self, palette):
+		super().__init__(FNode.wrap(palette.root), readOnly=True, palette=palette)
+		self.expandAll()
+
+
+	def dragEnterEvent(self, e):
+		return e.ignore()
+
+
+	def deleteSelectedItem(self):
+		return False
+
+
+	def onQuickButtonPressed(self, b, index, e):
+		prevSelection = self.selectedIndex()
+		prevTopIndex = self.indexAt(QPoint(0, 0))
+		self.clearSelection()
+		self.scrollTo(index, QAbstractItemView.ScrollHint.EnsureVisible)
+		p = self.visualRect(index).topLeft()
+		mpe = QMouseEvent(QEvent.Type.MouseButtonPress, e.position()+QPointF(p), Qt.MouseButton.LeftButton, Qt.MouseButton.NoButton, Qt.KeyboardModifier.NoModifier)
+		self.mousePressEvent(mpe)
+		self.startDrag(Qt.DropAction.CopyAction)
+		self.scrollTo(prevTopIndex, QAbstractItemView.ScrollHint.PositionAtTop)
+		self.clearSelection()
+		if(prevSelection):
+			self.selectIndex(prevSelection)
+
+
+class MainExpressionTree(NodeView):
+	def __init__(self):
+		super().__init__()
+		self.setStyleSheet(COMPOSITION_VIEW_STYLE)
+	
+	# Dropped constants start out as 0 and open for editing
+	def dropEvent(self, e: QDropEvent):
+		super().dropEvent(e)
+		index = self.lastDroppedIndex
+		if(e.source() != self and index and self.model().core(index).type() == FNodeType.CONSTANT):
+			self.model().setData(index, 0)
+			self.edit(index)
+
+
+class UserPalette(NodeView):
+	def __init__(self, palette=None):
+		self.palette = palette or FPalette()
+		super().__init__(FNode.wrap(self.palette.root), palette=self.palette)
+		self.isAddingDefaults = True
+
+	
+	def contextMenuEvent(self, e: QContextMenuEvent) -> None:
+		index = self.indexAt(e.pos())
+		m = QMenu()
+		aNewFolder = QAction('New Folder')
+		aRename = QAction('Rename')
+		aDelete = QAction('Delete')
+
+		m.addAction(aNewFolder)
+		if(index.isValid()):
+			m.addAction(aRename)
+			m.addAction(aDelete)
+		a = m.exec(self.mapToGlobal(e.pos()))
+
+		return super().contextMenuEvent(e)
+	
+
+	def mousePressEvent(self, e: QMouseEvent) -> None:
+		return super().mousePressEvent(e)
+
+
+
+class CompositionPanel(QFrame):
+	def __init__(self, defaultPalette, userPalette=None):
+		super().__init__()
+		self.nodePalette = NodePalette(defaultPalette)
+		self.userPalette = UserPalette(userPalette)
+		self.expTree = MainExpressionTree()
+
+		self.quickButtons = {}
+		for bLabel, tLabel in [('w', 'w'), ('x', 'x'), ('y', 'y'), ('z', 'z'), ('123', 'constant value'), ('+', 'plus'), ('-', 'minus'), ('*', 'multiply'), ('÷', 'divide'), ('^', 'exponential'), ('sin', 'sin')]:
+			index = QPersistentModelIndex(self.nodePalette.findIndex(tLabel))
+			b = QPushButton(bLabel)
+			b.setStyleSheet(QUICK_BUTTON_STYLE)
+			b.mousePressEvent = lambda e, b=b, index=index: self.nodePalette.onQuickButtonPressed(b, QModelIndex(index), e)
+			self.quickButtons[bLabel] = b
+
+
+		v = QVBoxLayout()
+
+		h = QHBoxLayout()
+		[h.addWidget(b) for b in self.quickButtons.values()]
+		v.addLayout(h)
+
+		h = QHBoxLayout()
+		tabs = QTabWidget()
+		tabs.addTab(self.nodePalette, 'Base Palette')
+		tabs.addTab(self.userPalette, 'User Palette')
+		h.addWidget(tabs)
+		h.addWidget(self.expTree, 1)
+		v.addLayout(h)
+
+		self.setLayout(v)
+
+
+	def keyPressEvent(self, e):
+		if(e.key() == Qt.Key.Key_B and e.modifiers() & Qt.KeyboardModifier.ControlModifier):
+			pass
+
+
+class Application(QApplication):
+	def __init__(self, *args, **kwargs):
+		super(Application, self).__init__(*args, **kwargs)
+
+		try:
+			defaultPalette = FPalette.open('default_palette.json')
+		except Exception as e:
+			print(f'Failed to open default_palette.json: {e}')
+			exit(1)
+
+		# Only the index of the user palette is read here, presets are parsed when they
+		# are first expanded or dragged.  A plain JSON palette from before is read once
+		# and saved in the indexed format on exit.
+		userPalette = None
+		canSave = True
+		for path in (USER_PALETTE, 'user_palette.json'):
+			if(os.path.exists(path)):
+				try:
+					userPalette = FPalette.open(path)
+				except Exception as e:
+					# Not saved over on exit then
+					print(f'Failed to open {path}: {e}')
+					canSave = False
+				break
+
+		self.compositionPanel = CompositionPanel(defaultPalette, userPalette)
+		self.previewPanel = PreviewPanel(self.compositionPanel.expTree)
+
+		v = QVBoxLayout()
+		v.addWidget(self.previewPanel)
+		v.addWidget(self.compositionPanel, 1)
+
+		f = QFrame()
+		f.setLayout(v)
+		self.mainWin = QMainWindow()
+		self.mainWin.setCentralWidget(f)
+		self.mainWin.setWindowTitle('Function Designer')
+		self.mainWin.setGeometry(0, 0, 600, 800)
+		self.mainWin.show()
+
+		self.previewPanel.previewFormula.setText('1+2*3*4+5+6')
+
+		self.exec()
+
+		palette = self.compositionPanel.userPalette.palette
+		if(canSave and (palette.root.children() or os.path.exists(USER_PALETTE))):
+			try:
+				palette.save(USER_PALETTE)
+			except OSError as e:
+				print(f'Failed to save {USER_PALETTE}: {e}')
+
+if __name__ == '__main__':
+	Application(sys.argv)
+
+	
+	
@@ -0,0 +1,263 @@
+from PyQt6.QtGui import *
+from PyQt6.QtCore import *
+from fnode import FNode, FNodeType
+from fcore import FCore
+
+
+# Item model reading straight from an FCore tree.  Indexes point at the core nodes
+# themselves, so the model keeps no per-node copy of the tree; FNodes are only wrapped
+# around nodes that get selected or edited.  Children are fetched FETCH_BATCH rows at
+# a time as the view scrolls or expands, so opening a huge palette or formula only
+# touches the rows on screen.  The tree must be changed through the model's insertNode(),
+# removeNode() and moveNode() so attached views are notified.  With an FPalette, its
+# presets are loaded when they are expanded or their node is taken.
+class FNodeModel(QAbstractItemModel):
+	FETCH_BATCH = 256
+	COLUMNS = 2
+
+	ITALIC_FONT = None
+
+	def __init__(self, rootNode:FNode, readOnly=False, palette=None):
+		super().__init__()
+		self.rootNode = rootNode
+		self.root = rootNode.core()
+		self.readOnly = readOnly
+		self.palette = palette
+		# id of a core node to (node, number of children fetched), the node reference
+		# keeps the id from being reused while the entry exists
+		self.fetched = {}
+		self.isChanging = False
+
+
+	def core(self, index) -> FCore:
+		return index.internalPointer() if index.isValid() else self.root
+
+
+	def node(self, index) -> FNode:
+		if(not index.isValid()):
+			return None
+		c = self.core(index)
+		if(self.palette):
+			self.palette.loadAll(c)
+		return FNode.wrap(c)
+
+
+	def isStub(self, c):
+		return self.palette is not None and self.palette.isStub(c)
+
+
+	def fetchedCount(self, c):
+		e = self.fetched.get(id(c))
+		return min(e[1], len(c._children)) if e else 0
+
+
+	# Index of a core node, fetching the rows before it where needed
+	def indexOf(self, c, column=0):
+		if(c is self.root or c is None):
+			return QModelIndex()
+		p = c._parent
+		row = p._children.index(c)
+		parent = self.indexOf(p)
+		if(row >= self.fetchedCount(p)):
+			self.fetchRows(parent, row + 1)
+		return self.createIndex(row, column, c)
+
+
+	def index(self, row, column, parent=QModelIndex()):
+		p = self.core(parent)
+		if(row < 0 or column < 0 or column >= FNodeModel.COLUMNS or row >= self.fetchedCount(p)):
+			return QModelIndex()
+		return self.createIndex(row, column, p._children[row])
+
+
+	def parent(self, index=QModelIndex()):
+		if(not index.isValid()):
+			return QModelIndex()
+		p = index.internalPointer()._parent
+		if(p is self.root or p is None or p._parent is None):
+			return QModelIndex()
+		return self.createIndex(p._parent._children.index(p), 0, p)
+
+
+	def rowCount(self, parent=QModelIndex()):
+		if(parent.column() > 0):
+			return 0
+		return self.fetchedCount(self.core(parent))
+
+
+	def columnCount(self, parent=QModelIndex()):
+		return FNodeModel.COLUMNS
+
+
+	def hasChildren(self, parent=QModelIndex()):
+		c = self.core(parent)
+		return parent.column() <= 0 and (bool(c._children) or self.isStub(c))
+
+
+	# Views ask for more rows while being told about rows being added, which must not
+	# start a fetch in the middle of the change
+	def canFetchMore(self, parent):
+		c = self.core(parent)
+		return not self.isChanging and (self.fetchedCount(c) < len(c._children) or self.isStub(c))
+
+
+	def fetchMore(self, parent):
+		if(self.isChanging):
+			return
+		c = self.core(parent)
+		self.fetchRows(parent, self.fetchedCount(c) + FNodeModel.FETCH_BATCH)
+
+
+	def fetchRows(self, parent, count):
+		c = self.core(parent)
+		if(self.isStub(c)):
+			self.palette.load([c])
+		first = self.fetchedCount(c)
+		count = min(count, len(c._children))
+		if(count <= first):
+			return
+		self.isChanging = True
+		try:
+			self.beginInsertRows(parent, first, count - 1)
+			self.fetched[id(c)] = (c, count)
+			self.endInsertRows()
+		finally:
+			self.isChanging = False
+
+
+	def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+		if(not index.isValid()):
+			return None
+		c = index.internalPointer()
+		t = c._type
+		if(role == Qt.ItemDataRole.DisplayRole):
+			if(index.column() == 1):
+				return 'variable' if t == FNodeType.VARIABLE else 'function' if t == FNodeType.FUNCTION else None
+			return FNodeModel.text(c)
+		if(role == Qt.ItemDataRole.EditRole and t == FNodeType.CONSTANT):
+			return c.formula()
+		if(role == Qt.ItemDataRole.FontRole):
+			if((index.column() == 0 and c._name) or (index.column() == 1 and t in (FNodeType.VARIABLE, FNodeType.FUNCTION))):
+				return FNodeModel.italicFont()
+		return None
+
+
+	@classmethod
+	def text(_, c):
+		if(c._type == FNodeType.CONSTANT):
+			return c._name or c.formula()
+		s = c._name or FCore.TYPE_NAMES.get(c._type, c._type.name)
+		return '-' + s if c._negated and not c._name else s
+
+
+	@classmethod
+	def italicFont(_):
+		if(not FNodeModel.ITALIC_FONT):
+			FNodeModel.ITALIC_FONT = QFont('Segoe UI', 9, italic=True)
+		return FNodeModel.ITALIC_FONT
+
+
+	# Read-only models (the base palette) only allow dragging presets out of them
+	def flags(self, index):
+		if(not index.isValid()):
+			return Qt.ItemFlag.NoItemFlags if self.readOnly else Qt.ItemFlag.ItemIsDropEnabled
+		f = Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable
+		t = index.internalPointer()._type
+		if(not self.readOnly):
+			f |= Qt.ItemFlag.ItemIsDragEnabled | Qt.ItemFlag.ItemIsDropEnabled
+			if(t == FNodeType.CONSTANT and index.column() == 0):
+				f |= Qt.ItemFlag.ItemIsEditable
+		elif(t != FNodeType.SET):
+			f |= Qt.ItemFlag.ItemIsDragEnabled
+		return f
+
+
+	def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+		c = self.core(index)
+		if(role != Qt.ItemDataRole.EditRole or c._type != FNodeType.CONSTANT):
+			return False
+		try:
+			v = float(value)
+		except ValueError:
+			return False
+		n = FNode.wrap(c)
+		n.setName(None)
+		n.setConstantValue(v)
+		self.dataChanged.emit(index, index)
+		return True
+
+
+	def supportedDropActions(self):
+		return Qt.DropAction.CopyAction | Qt.DropAction.MoveAction
+
+
+	# Adds n as child row of the node at parent, by default after its last child
+	def insertNode(self, n:FNode, parent=QModelIndex(), row=None):
+		p = self.core(parent)
+		if(self.isStub(p)):
+			self.palette.load([p])
+		row = len(p._children) if row is None else row
+		fetched = self.fetchedCount(p)
+		if(row <= fetched):
+			self.isChanging = True
+			try:
+				self.beginInsertRows(parent, row, row)
+				FNode.wrap(p).addChild(n, row)
+				self.fetched[id(p)] = (p, fetched + 1)
+				self.endInsertRows()
+			finally:
+				self.isChanging = False
+		else:
+			FNode.wrap(p).addChild(n, row)
+		return self.indexOf(n.core())
+
+
+	def _detach(self, index):
+		c = self.core(index)
+		p = c._parent
+		parent = self.parent(index)
+		fetched = self.fetchedCount(p)
+		self.isChanging = True
+		try:
+			self.beginRemoveRows(parent, index.row(), index.row())
+			FNode.wrap(p).removeChild(FNode.wrap(c))
+			self.fetched[id(p)] = (p, fetched - 1)
+			self.endRemoveRows()
+		finally:
+			self.isChanging = False
+		return c
+
+
+	def removeNode(self, index):
+		c = self._detach(index)
+		stack = [c]
+		while(stack):
+			n = stack.pop()
+			self.fetched.pop(id(n), None)
+			if(self.palette):
+				self.palette.discard(n)
+			stack.extend(n._children)
+		FNode.wrap(c).delete()
+
+
+	# Moves the node at index to row of the node at parent, row counting the children
+	# of the new parent before the node is taken out
+	def moveNode(self, index, parent, row):
+		c = self.core(index)
+		p = self.core(parent)
+		if(c._parent is p and row > index.row()):
+			row -= 1
+		self._detach(index)
+		return self.insertNode(FNode.wrap(c), self.indexOf(p), row)
+
+
+	def clear(self):
+		self.isChanging = True
+		try:
+			self.beginResetModel()
+			for c in list(self.root._children):
+				FNode.wrap(c).delete()
+			self.fetched = {}
+			self.endResetModel()
+		finally:
+			self.isChanging = False
@@ -1,233 +1,210 @@
-from PyQt6.QtWidgets import *
-from PyQt6.QtGui import *
-from PyQt6.QtCore import *
-from fnode import FNode, FNodeType
-from stylesheets import *
-
-
-class NodeView(QTreeWidget):
-	ITALIC_FONT = QFont('Segoe UI', 9, italic=True)
-	
-	def __init__(self):
-		super(QTreeWidget, self).__init__()
-		self.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
-		self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-		self.setHeaderHidden(True)
-		self.setDragDropMode(self.DragDropMode.DragDrop)
-		self.setAcceptDrops(True)
-		self.setColumnCount(3)
-		self.setColumnWidth(1, 50)
-		self.setColumnWidth(2, 25)
-		self.header().setStretchLastSection(False)
-		self.header().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
-
-		self.tItemsByNodeID = {}
-		self.rootNode = FNode(FNodeType.ROOT)
-		self.attachNode(self.invisibleRootItem(), self.rootNode)
-
-		self.blockItemUpdates = True
-
-	
-	def selectedItem(self) -> QTreeWidgetItem:
-		tItems = self.selectedItems()
-		return tItems[0] if tItems else None
-	
-
-	def attachNode(self, tItem: QTreeWidgetItem, n: FNode):
-		tItem.setData(0, Qt.ItemDataRole.UserRole, n.nodeID())
-		tItem.setText(2, str(n.nodeID()))
-		self.tItemsByNodeID[n.nodeID()] = tItem
-	
-
-	def attachedNode(self, tItem: QTreeWidgetItem) -> FNode:
-		return FNode.getNode(tItem.data(0, Qt.ItemDataRole.UserRole)) if tItem else None
-	
-
-	def selectedNode(self) -> FNode:
-		return self.attachedNode(self.selectedItem())
-
-
-	# Ensure FNode heirarchy is up to date before calling
-	def createTreeItems(self, n, pItem=None, idx=None):
-		if(n.type() == FNodeType.ROOT):
-			for c in n.children():
-				self.createTreeItems(c, self.invisibleRootItem())
-			return
-		pItem = pItem or self.tItemsByNodeID.get(n.parent())
-		idx = n.parent().children().index(n) if idx is None else idx
-		tItem = QTreeWidgetItem()
-		self.attachNode(tItem, n)
-
-		if(n.name()):
-			tItem.setText(0, n.name())
-			tItem.setFont(0, NodeView.ITALIC_FONT)
-		else:
-			tItem.setText(0, FNode.TYPE_NAMES[n.type()])
-		if(n.type() == FNodeType.CONSTANT):
-			tItem.setText(0, tItem.text(0) or n.formula())
-			tItem.setFlags(tItem.flags() | Qt.ItemFlag.ItemIsEditable)
-		elif(n.type() == FNodeType.VARIABLE):
-			tItem.setText(1, 'variable')
-			tItem.setFont(1, NodeView.ITALIC_FONT)
-		elif(n.type() == FNodeType.FUNCTION):
-			tItem.setText(1, 'function')
-			tItem.setFont(1, NodeView.ITALIC_FONT)
-		elif(n.isNegated()):
-			tItem.setText(0, '-'+tItem.text(0))
-		
-		pItem.insertChild(idx, tItem)
-		for c in n.children():
-			self.createTreeItems(c, tItem)
-		pItem.setExpanded(True)
-		return tItem
-	
-
-	def deleteItem(self, tItem:QTreeWidgetItem):
-		n = self.attachedNode(tItem)
-		n.delete()
-		pItem = tItem.parent() or self.invisibleRootItem()
-		pItem.removeChild(tItem)
-	
-
-	def deleteSelectedItem(self, warnIfChildren=True):
-		tItem = self.selectedItem()
-		if(not tItem):
-			return False
-		n = self.attachedNode(tItem)
-		if(warnIfChildren and n.children()):
-			msg = QMessageBox()
-			msg.setText('The selected node is not a leaf.  Are you sure you want to delete the selected node and all of its children?')
-			msg.setStandardButtons(QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
-			r = msg.exec()
-			if(not r):
-				return
-		return self.deleteItem(tItem)
-	
-
-	def copySelectedItem(self):
-		n = self.selectedNode()
-		if(not n):
-			return False
-		QApplication.clipboard().setText(n.asString())
-		return True
-	
-
-	def cutSelectedItem(self):
-		if(self.copySelectedItem()):
-			self.deleteItemAndNodes(self.selectedItem())
-			return True
-		return False
-
-
-	def pasteFromClipboard(self):
-		pItem = self.selectedItem() or self.invisibleRootItem()
-		pn = self.attachedNode(pItem)
-		n = FNode.fromString(QApplication.clipboard().text())
-		if(n):
-			pn.addChild(n)
-			self.createTreeItems(n, pItem)
-			return True
-		return False
-
-
-	def onItemUpdated(self, itemUpdated):
-		if(self.blockItemUpdates):
-			return
-		n = self.attachedNode(itemUpdated[0])
-		if(not n or n.type() != FNodeType.CONSTANT):
-			return
-		try:
-			n.setConstantValue(float(itemUpdated[0].text(0)))
-		except:
-			itemUpdated[0].setText(0, '0')
-	
-
-	def replaceSelectedNode(self, n):
-		tItem = self.selectedItem()
-		if(not tItem):
-			self.invisibleRootItem().takeChildren()
-			[c.delete() for c in self.rootNode.children()]
-			pItem = self.invisibleRootItem()
-			idx = None
-		else:
-			pItem = tItem.parent() or self.invisibleRootItem()
-			idx = pItem.indexOfChild(tItem)
-			self.deleteItem(tItem)
-			pItem.removeChild(tItem)
-		self.attachedNode(pItem).addChild(n, idx)
-		tItem = self.createTreeItems(n, pItem, idx)
-		self.clearSelection()
-		tItem.setSelected(True)
-
-
-	def startDrag(self, supportedActions):
-		self.lastDraggedItem = self.selectedItem()
-		return super().startDrag(supportedActions)
-
-
-	def dropEvent(self, e: QDropEvent):
-		if(not isinstance(e.source(), NodeView)):
-			e.ignore()
-			return
-	
-		#itemFromIndex
-		#itemAbove
-		#itemBelow
-		sourceItemDragged = e.source().selectedItem()
-		sourcePItemDragged = sourceItemDragged.parent() or self.invisibleRootItem()
-		ePos = e.position().toPoint()
-		tItemDroppedAt = self.itemAt(ePos)
-
-		match(self.dropIndicatorPosition()):
-			case self.DropIndicatorPosition.AboveItem:
-				newPItem = tItemDroppedAt.parent() or self.invisibleRootItem()
-				newIdx = self.indexAt(ePos).row()
-			case self.DropIndicatorPosition.BelowItem:
-				newPItem = tItemDroppedAt.parent() or self.invisibleRootItem()
-				newIdx = self.indexAt(ePos).row() + 1
-			case self.DropIndicatorPosition.OnItem:
-				if(sourceItemDragged == tItemDroppedAt):
-					return
-				newPItem = tItemDroppedAt
-				newIdx = tItemDroppedAt.childCount()
-			case self.DropIndicatorPosition.OnViewport:
-				newPItem = self.invisibleRootItem()
-				newIdx = self.invisibleRootItem().childCount()
-
-		newParent = self.attachedNode(newPItem)
-
-		if(e.source() != self):
-			e.setDropAction(Qt.DropAction.CopyAction)
-			droppedNode = self.attachedNode(sourceItemDragged).copy()
-			newParent.addChild(droppedNode, newIdx)
-			self.createTreeItems(droppedNode, newPItem, newIdx)
-		else:
-			e.setDropAction(Qt.DropAction.MoveAction)
-			droppedNode = self.attachedNode(sourceItemDragged)
-			if(sourcePItemDragged == newPItem):
-				oldIdx = sourcePItemDragged.indexOfChild(sourceItemDragged)
-				if(newIdx > oldIdx):
-					newIdx -= 1
-			newParent.addChild(droppedNode, newIdx)
-			super().dropEvent(e)
-
-
-	def dragEnterEvent(self, e):
-		if(not isinstance(e.source(), NodeView)):
-			e.ignore()
-			return
-		return super().dragEnterEvent(e)
-
-
-	def keyPressEvent(self, e):
-		if(e.key() == Qt.Key.Key_Delete or e.key() == Qt.Key.Key_Backspace):
-			self.deleteSelectedItem()
-		elif(e.key() == Qt.Key.Key_C and e.modifiers() & Qt.KeyboardModifier.ControlModifier):
-			self.copySelectedItem()
-		elif(e.key() == Qt.Key.Key_X and e.modifiers() & Qt.KeyboardModifier.ControlModifier):
-			self.cutSelectedItem()
-		elif(e.key() == Qt.Key.Key_V and e.modifiers() & Qt.KeyboardModifier.ControlModifier):
-			self.pasteFromClipboard()
-		else:
-			return super().keyPressEvent(e)
-		
\ No newline at end of file
+from PyQt6.QtWidgets import *
+from PyQt6.QtGui import *
+from PyQt6.QtCore import *
+from fnode import FNode, FNodeType
+from node_model import FNodeModel
+from fcodec import FCodec
+from stylesheets import *
+
+
+class NodeView(QTreeView):
+	# Inserted subtrees up to this many nodes are expanded completely, larger ones only
+	# show their first level
+	EXPAND_NODES = 200
+
+	itemSelectionChanged = pyqtSignal()
+
+	def __init__(self, rootNode=None, readOnly=False, palette=None):
+		super().__init__()
+		self.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+		self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+		self.setHeaderHidden(True)
+		self.setDragDropMode(self.DragDropMode.DragDrop)
+		self.setAcceptDrops(True)
+		self.setUniformRowHeights(True)
+
+		self.rootNode = rootNode or FNode(FNodeType.ROOT)
+		self.setModel(FNodeModel(self.rootNode, readOnly, palette))
+		self.setColumnWidth(1, 50)
+		self.header().setStretchLastSection(False)
+		self.header().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+		self.lastDroppedIndex = None
+
+
+	def selectionChanged(self, selected, deselected):
+		super().selectionChanged(selected, deselected)
+		self.itemSelectionChanged.emit()
+
+
+	def selectedIndex(self) -> QModelIndex:
+		indexes = self.selectionModel().selectedRows()
+		return indexes[0] if indexes else None
+
+
+	def selectedNode(self) -> FNode:
+		index = self.selectedIndex()
+		return self.model().node(index) if index else None
+
+
+	def selectIndex(self, index):
+		self.selectionModel().select(index, QItemSelectionModel.SelectionFlag.ClearAndSelect | QItemSelectionModel.SelectionFlag.Rows)
+		self.setCurrentIndex(index)
+
+
+	# First node shown as text, searched depth first without fetching rows that are not needed
+	def findIndex(self, text) -> QModelIndex:
+		model = self.model()
+		stack = list(reversed(model.root.children()))
+		while(stack):
+			c = stack.pop()
+			if(FNodeModel.text(c) == text):
+				return model.indexOf(c)
+			stack.extend(reversed(c.children()))
+		return None
+
+
+	def expandInserted(self, index):
+		if(self.model().core(index).nodeCount() <= NodeView.EXPAND_NODES):
+			self.expandRecursively(index)
+		else:
+			self.expand(index)
+		if(index.parent().isValid()):
+			self.expand(index.parent())
+
+
+	def insertNode(self, n, parent=QModelIndex(), row=None):
+		index = self.model().insertNode(n, parent, row)
+		self.expandInserted(index)
+		return index
+
+
+	def deleteSelectedItem(self, warnIfChildren=True):
+		index = self.selectedIndex()
+		if(not index):
+			return False
+		if(warnIfChildren and self.model().hasChildren(index)):
+			msg = QMessageBox()
+			msg.setText('The selected node is not a leaf.  Are you sure you want to delete the selected node and all of its children?')
+			msg.setStandardButtons(QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+			r = msg.exec()
+			if(r != QMessageBox.StandardButton.Yes):
+				return False
+		self.model().removeNode(index)
+		return True
+
+
+	# Copied as JSON text for other programs and in the binary FCodec form, which is
+	# what pasting in a view reads
+	def copySelectedItem(self):
+		n = self.selectedNode()
+		if(not n):
+			return False
+		mime = QMimeData()
+		mime.setText(n.asJSON())
+		mime.setData(FCodec.MIME_TYPE, QByteArray(n.asBytes()))
+		QApplication.clipboard().setMimeData(mime)
+		return True
+
+
+	def cutSelectedItem(self):
+		if(self.copySelectedItem()):
+			return self.deleteSelectedItem(False)
+		return False
+
+
+	def pasteFromClipboard(self):
+		mime = QApplication.clipboard().mimeData()
+		if(mime.hasFormat(FCodec.MIME_TYPE)):
+			try:
+				n = FNode.fromBytes(mime.data(FCodec.MIME_TYPE).data())
+			except ValueError as e:
+				print(f'Invalid clipboard data: {e}')
+				n = None
+		else:
+			n = FNode.fromString(mime.text())
+		if(n):
+			self.insertNode(n, self.selectedIndex() or QModelIndex())
+			return True
+		return False
+
+
+	def replaceSelectedNode(self, n):
+		index = self.selectedIndex()
+		if(not index):
+			self.model().clear()
+			parent = QModelIndex()
+			row = None
+		else:
+			parent = index.parent()
+			row = index.row()
+			self.model().removeNode(index)
+		self.selectIndex(self.insertNode(n, parent, row))
+
+
+	# Returns the parent index and row a drop at pos goes to
+	def dropTarget(self, pos):
+		index = self.indexAt(pos)
+		match(self.dropIndicatorPosition()):
+			case self.DropIndicatorPosition.AboveItem:
+				return index.parent(), index.row()
+			case self.DropIndicatorPosition.BelowItem:
+				return index.parent(), index.row() + 1
+			case self.DropIndicatorPosition.OnItem:
+				return index.siblingAtColumn(0), None
+		return QModelIndex(), None
+
+
+	# Nodes dragged from another view are copied, nodes dragged inside the view are
+	# moved.  The view's model is changed directly, the drop is then reported as a copy
+	# so the source view does not remove anything itself.
+	def dropEvent(self, e: QDropEvent):
+		source = e.source()
+		if(not isinstance(source, NodeView) or not source.selectedIndex()):
+			e.ignore()
+			return
+		sourceIndex = source.selectedIndex()
+		parent, row = self.dropTarget(e.position().toPoint())
+		self.lastDroppedIndex = None
+
+		if(source != self):
+			n = source.model().node(sourceIndex).copy()
+			self.lastDroppedIndex = self.insertNode(n, parent, row)
+		else:
+			# A node cannot be moved into its own subtree
+			c = self.model().core(sourceIndex)
+			p = self.model().core(parent)
+			while(p is not None):
+				if(p is c):
+					e.ignore()
+					return
+				p = p.parent()
+			if(row is None):
+				row = len(self.model().core(parent).children())
+			self.lastDroppedIndex = self.model().moveNode(sourceIndex, parent, row)
+			self.expandInserted(self.lastDroppedIndex)
+		self.selectIndex(self.lastDroppedIndex)
+		e.setDropAction(Qt.DropAction.CopyAction)
+		e.accept()
+		self.stopAutoScroll()
+		self.setState(self.State.NoState)
+		self.viewport().update()
+
+
+	def dragEnterEvent(self, e):
+		if(not isinstance(e.source(), NodeView)):
+			e.ignore()
+			return
+		return super().dragEnterEvent(e)
+
+
+	def keyPressEvent(self, e):
+		if(e.key() == Qt.Key.Key_Delete or e.key() == Qt.Key.Key_Backspace):
+			self.deleteSelectedItem()
+		elif(e.key() == Qt.Key.Key_C and e.modifiers() & Qt.KeyboardModifier.ControlModifier):
+			self.copySelectedItem()
+		elif(e.key() == Qt.Key.Key_X and e.modifiers() & Qt.KeyboardModifier.ControlModifier):
+			self.cutSelectedItem()
+		elif(e.key() == Qt.Key.Key_V and e.modifiers() & Qt.KeyboardModifier.ControlModifier):
+			self.pasteFromClipboard()
+		else:
+			return super().keyPressEvent(e)
@@ -1,2 +1,16 @@
-CURVE_RESOLUTION = 512
-CURVE_FRAMES = 512
\ No newline at end of file
+CURVE_RESOLUTION = 512
+CURVE_FRAMES = 512
+# Precision of evaluated wavetables, float32 halves memory and is plenty for audio
+CURVE_DTYPE = 'float32'
+# Memory budget of the shared node value cache, least recently used values beyond it
+# are dropped and recomputed on demand
+VALUE_CACHE_BYTES = 512 * 2**20
+# Number of tree nodes the formula cache keeps parsed, across all cached formulas
+FORMULA_CACHE_NODES = 200000
+# Full tables are evaluated in blocks of frames of about this many bytes per
+# intermediate, about the size of the L2 cache of a core
+EVAL_CHUNK_BYTES = 2**20
+# Threads evaluating those blocks in parallel, 0 uses every core
+EVAL_THREADS = 0
+# User palette file, in the indexed FPalette format
+USER_PALETTE = 'user_palette.fpal'
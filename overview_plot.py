@@ -0,0 +1,159 @@
+from PyQt6.QtWidgets import *
+from PyQt6.QtGui import *
+from PyQt6.QtCore import *
+import numpy as np
+from options import CURVE_FRAMES
+
+
+# Whole wavetable at a glance, as a heatmap with one row per frame or as a stack of
+# waveforms receding from the first frame at the front.  The image is built with
+# numpy at up to MAX_IMAGE_SIZE pixels per axis and scaled to the widget, so it is
+# only rebuilt when the curve changes.  Double-click switches between the two.
+class OverviewPlot(QWidget):
+	frameSelected = pyqtSignal(int)
+
+	HEATMAP = 0
+	WATERFALL = 1
+
+	MAX_IMAGE_SIZE = 1024
+	WATERFALL_FRAMES = 48
+	WATERFALL_HEIGHT = 400
+
+	LUT = None
+
+	def __init__(self):
+		super().__init__()
+		self.setMouseTracking(True)
+		self.curve = None
+		self.curveSource = None
+		self.frame = 0
+		self.mode = OverviewPlot.HEATMAP
+		self.images = {}
+
+
+	def setCurve(self, curve):
+		if(curve is not None and curve is self.curveSource):
+			return
+		self.curveSource = curve
+		if(curve is None):
+			self.curve = None
+		elif(not np.shape(curve)):
+			self.curve = np.full((1, 1), curve)
+		else:
+			self.curve = curve
+		self.images = {}
+		self.update()
+
+
+	def setFrame(self, idx):
+		self.frame = idx
+		self.update()
+
+
+	def mouseDoubleClickEvent(self, e):
+		self.mode = OverviewPlot.WATERFALL if self.mode == OverviewPlot.HEATMAP else OverviewPlot.HEATMAP
+		self.update()
+
+
+	def mousePressEvent(self, e):
+		if(self.mode == OverviewPlot.HEATMAP and e.button() == Qt.MouseButton.LeftButton):
+			frame = int(e.position().y() / max(self.height(), 1) * CURVE_FRAMES)
+			self.frameSelected.emit(min(max(frame, 0), CURVE_FRAMES - 1))
+		return super().mousePressEvent(e)
+
+
+	# Colors of values from -1 (blue) through 0 (black) to 1 (green) as 0xffrrggbb, with
+	# a last entry for samples that are not finite
+	@classmethod
+	def lut(_):
+		if(OverviewPlot.LUT is None):
+			t = np.linspace(-1, 1, 256)
+			neg = np.clip(-t, 0, 1)
+			pos = np.clip(t, 0, 1)
+			r = (neg * 60).astype(np.uint32)
+			g = (pos * 255).astype(np.uint32)
+			b = (neg * 255).astype(np.uint32)
+			lut = 0xff000000 | (r << 16) | (g << 8) | b
+			OverviewPlot.LUT = np.append(lut, np.uint32(0xff802020))
+		return OverviewPlot.LUT
+
+
+	# Every step-th frame and sample, so that neither axis exceeds size
+	@classmethod
+	def decimate(_, curve, size):
+		return curve[::-(-curve.shape[0] // size), ::-(-curve.shape[1] // size)]
+
+
+	@classmethod
+	def toImage(_, pixels):
+		pixels = np.ascontiguousarray(pixels, np.uint32)
+		h, w = pixels.shape
+		image = QImage(pixels.data, w, h, w * 4, QImage.Format.Format_RGB32)
+		# The image does not own its memory, keep the array alive next to it
+		image.pixels = pixels
+		return image
+
+
+	# Values are clipped to [-1, 1] and looked up in the LUT in a single pass
+	@classmethod
+	def heatmap(_, curve) -> QImage:
+		v = OverviewPlot.decimate(curve, OverviewPlot.MAX_IMAGE_SIZE)
+		with np.errstate(invalid='ignore'):
+			idx = np.rint((np.clip(v, -1, 1) + 1) * 127.5)
+		idx = np.where(np.isfinite(v), idx, 256).astype(np.intp)
+		return OverviewPlot.toImage(OverviewPlot.lut()[idx])
+
+
+	# Waveforms of WATERFALL_FRAMES evenly spaced frames, each shifted up and right
+	# from the one before.  They are drawn back to front, every waveform blanking the
+	# area below it so it hides the ones behind.  Each column of a waveform is a
+	# vertical span between its sample and the next one, found with one comparison of
+	# the whole image against the spans.
+	@classmethod
+	def waterfall(_, curve) -> QImage:
+		frames = min(OverviewPlot.WATERFALL_FRAMES, curve.shape[0])
+		rows = np.linspace(0, curve.shape[0] - 1, frames).round().astype(np.intp)
+		v = curve[rows][:, ::-(-curve.shape[1] // (OverviewPlot.MAX_IMAGE_SIZE // 2))]
+		v = np.nan_to_num(np.clip(v, -1, 1))
+
+		n = v.shape[1]
+		h = OverviewPlot.WATERFALL_HEIGHT
+		shiftX = n // 2 // max(frames - 1, 1)
+		shiftY = h * 0.6 / max(frames - 1, 1)
+		amp = h * 0.18
+		w = n + shiftX * (frames - 1)
+
+		pixels = np.full((h, w), 0xff000000, np.uint32)
+		y = np.arange(h).reshape(-1, 1)
+		for k in range(frames - 1, -1, -1):
+			base = h - amp - 2 - k * shiftY
+			ys = base - v[k] * amp
+			nextYs = np.append(ys[1:], ys[-1])
+			lo = np.minimum(ys, nextYs).round() - 1
+			hi = np.maximum(ys, nextYs).round() + 1
+			block = pixels[:, k * shiftX:k * shiftX + n]
+			block[(y > hi) & (y <= base + amp + 1)] = 0xff000000
+			shade = int(255 - 160 * k / max(frames - 1, 1))
+			block[(y >= lo) & (y <= hi)] = 0xff000000 | (shade // 4 << 16) | (shade << 8) | shade // 4
+		return OverviewPlot.toImage(pixels)
+
+
+	def image(self):
+		image = self.images.get(self.mode)
+		if(image is None):
+			build = OverviewPlot.heatmap if self.mode == OverviewPlot.HEATMAP else OverviewPlot.waterfall
+			image = self.images[self.mode] = build(self.curve)
+		return image
+
+
+	def paintEvent(self, e):
+		p = QPainter(self)
+		p.fillRect(0, 0, self.width(), self.height(), Qt.GlobalColor.black)
+		if(self.curve is not None):
+			p.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+			p.drawImage(QRect(0, 0, self.width(), self.height()), self.image())
+			if(self.mode == OverviewPlot.HEATMAP):
+				y = int((self.frame + 0.5) / CURVE_FRAMES * self.height())
+				p.setPen(QPen(Qt.GlobalColor.gray, 1, Qt.PenStyle.SolidLine))
+				p.drawLine(0, y, self.width(), y)
+		p.end()
@@ -2,10 +2,15 @@ from tkinter.font import names
 from PyQt6.QtWidgets import *
 from PyQt6.QtGui import *
 from PyQt6.QtCore import *
-from options import CURVE_FRAMES, CURVE_RESOLUTION
+from options import CURVE_FRAMES, CURVE_RESOLUTION, CURVE_DTYPE
 from stylesheets import *
 from preview_plot import PreviewPlot
+from overview_plot import OverviewPlot
 from fnode import FNode
+from fworker import FEvaluator
+from fcache import FValueCache
+from fexport import FExport
+from fcodec import FCodec
 
 
 class PreviewPanel(QFrame):
@@ -28,9 +33,13 @@ class PreviewPanel(QFrame):
 		self.previewPlot.setMinimumWidth(600)
 		self.previewPlot.setMinimumHeight(250)
 
+		self.overviewPlot = OverviewPlot()
+		self.overviewPlot.setFixedHeight(90)
+
 		self.frameIdx = QSlider(Qt.Orientation.Horizontal)
 		self.frameIdx.setMaximum(CURVE_FRAMES-1)
 		self.frameIdx.valueChanged.connect(self.onFrameIdxChanged)
+		self.overviewPlot.frameSelected.connect(self.frameIdx.setValue)
 
 		self.labelFrameIdx = QLabel('0', )
 		self.labelFrameIdx.setFont(QFont('Consolas', 12))
@@ -61,23 +70,52 @@ class PreviewPanel(QFrame):
 		v = QVBoxLayout()
 		v.addWidget(self.previewFormula)
 		v.addWidget(self.previewPlot, 1)
+		v.addWidget(self.overviewPlot)
 		v.addLayout(h)
 		self.setLayout(v)
 	
 
 	def setActiveNode(self, n):
+		if(self.activeNode):
+			try:
+				self.activeNode.nodeStateChanged.disconnect(self.onActiveNodeStateChanged)
+			except:
+				pass
+		self.activeNode = n
 		if(not n):
 			self.previewPlot.setCurve(None)
+			self.overviewPlot.setCurve(None)
 			s = ''
 		else:
-			self.previewPlot.setCurve(n.value())
+			n.nodeStateChanged.connect(self.onActiveNodeStateChanged)
+			self.onActiveNodeStateChanged(n, n.state())
 			s = n.formula()
 		self.lastFormula = s
 		self.previewFormula.setText(s)
 	
 
+	# Values are evaluated in the background, the visible frame first at the plot's
+	# width and full resolution, then the rest of the wavetable.  The plot keeps showing
+	# the previous curve until the first of those levels is ready.
+	def onActiveNodeStateChanged(self, n, state):
+		if(state != FNode.CALCULATED):
+			self.overviewPlot.setCurve(None)
+			return self.previewPlot.setCurve(None)
+		frame = self.frameIdx.value()
+		v = n.requestValue(frame, self.previewPlot.width())
+		if(v is not None):
+			self.overviewPlot.setCurve(v)
+			return self.previewPlot.setCurve(v)
+		samples = n.previewValue(frame)
+		if(samples is not None):
+			self.previewPlot.setPartialFrame(samples)
+
+
 	def onFrameIdxChanged(self, frameIdx):
 		self.previewPlot.setFrame(self.frameIdx.value())
+		self.overviewPlot.setFrame(self.frameIdx.value())
+		if(self.activeNode):
+			self.onActiveNodeStateChanged(self.activeNode, self.activeNode.state())
 		self.labelFrameIdx.setText(str(self.frameIdx.value()))
 		self.labelZValue.setText(f'{self.frameIdx.value()/self.frameIdx.maximum():0.3f}')
 
@@ -96,6 +134,89 @@ class PreviewPanel(QFrame):
 	
 	def mouseMoveEvent(self, e):
 		if(self.previewPlot.cursorPos):
-			self.previewPlot.cursorPos = None
-			self.previewPlot.update()
+			self.previewPlot.setCursorPos(None)
 		return super().mouseMoveEvent(e)
+
+
+	def contextMenuEvent(self, e):
+		m = QMenu()
+		aExport = m.addAction('Export Wavetable...')
+		aMipmaps = m.addAction('Export Mipmaps...')
+		m.addSeparator()
+		aOpen = m.addAction('Open Document...')
+		aSave = m.addAction('Save Document...')
+		isCalculated = bool(self.activeNode and self.activeNode.state() == FNode.CALCULATED)
+		aExport.setEnabled(isCalculated)
+		aMipmaps.setEnabled(isCalculated)
+		aSave.setEnabled(bool(self.activeNode))
+		a = m.exec(e.globalPos())
+		if(a == aExport):
+			self.exportActiveNode()
+		elif(a == aMipmaps):
+			self.exportActiveNode(mipmaps=True)
+		elif(a == aOpen):
+			self.openDocument()
+		elif(a == aSave):
+			self.saveActiveNode()
+
+
+	# Writes the cached table if there is one, otherwise evaluates it straight into the
+	# file.  Mipmaps are normalized, without DC and written to one file per octave.
+	def exportActiveNode(self, mipmaps=False):
+		n = self.activeNode
+		path, _ = QFileDialog.getSaveFileName(self, 'Export Mipmaps' if mipmaps else 'Export Wavetable', 'wavetable.wav', 'WAV (*.wav);;Raw 32-bit float (*.f32);;NumPy (*.npy)')
+		if(not path):
+			return
+		# Tables that are not cached yet are evaluated on the FEvaluator pool, behind a
+		# progress dialog that cancels the export
+		v = FValueCache.instance().peek(n.valueKey())
+		try:
+			plan = n.plan() if v is None else None
+		except ValueError as e:
+			QMessageBox.warning(self, 'Export failed', str(e))
+			return
+		progress = QProgressDialog('Exporting mipmaps...' if mipmaps else 'Exporting wavetable...', 'Cancel', 0, 0, self)
+		progress.setWindowModality(Qt.WindowModality.WindowModal)
+		progress.setMinimumDuration(500)
+		evaluator = FEvaluator.instance()
+		def onFinished(j, done, error):
+			if(j is not job):
+				return
+			evaluator.exportFinished.disconnect(connection)
+			progress.reset()
+			progress.deleteLater()
+			if(error):
+				QMessageBox.warning(self, 'Export failed', error)
+		connection = evaluator.exportFinished.connect(onFinished)
+		job = evaluator.export(plan, path, mipmaps, v)
+		progress.canceled.connect(job.cancel)
+
+
+	# Documents hold the tree of the active node and its table if it is evaluated
+	def saveActiveNode(self):
+		n = self.activeNode
+		path, _ = QFileDialog.getSaveFileName(self, 'Save Document', 'function.fdoc', 'Function document (*.fdoc)')
+		if(not path):
+			return
+		try:
+			table = FValueCache.instance().peek(n.valueKey()) if n.state() == FNode.CALCULATED else None
+			FCodec.save(path, n.core(), table)
+		except (ValueError, OSError) as e:
+			QMessageBox.warning(self, 'Saving failed', str(e))
+
+
+	# The stored table goes into the value cache, so the document shows without being
+	# evaluated again unless it was saved at another size or precision
+	def openDocument(self):
+		path, _ = QFileDialog.getOpenFileName(self, 'Open Document', '', 'Function document (*.fdoc)')
+		if(not path):
+			return
+		try:
+			tree, table = FCodec.load(path)
+		except (ValueError, OSError) as e:
+			QMessageBox.warning(self, 'Opening failed', str(e))
+			return
+		n = FNode.wrap(tree.toCore())
+		if(table is not None and table.shape == (CURVE_FRAMES, CURVE_RESOLUTION) and table.dtype == CURVE_DTYPE and n.state() == FNode.CALCULATED):
+			FValueCache.instance().put(n.valueKey(), table)
+		self.activeNodeReplaced.emit(n)
@@ -3,6 +3,7 @@ from PyQt6.QtWidgets import *
 from PyQt6.QtGui import *
 from PyQt6.QtCore import *
 import numpy as np
+from collections import OrderedDict
 from options import CURVE_FRAMES, CURVE_RESOLUTION
 from stylesheets import *
 
@@ -10,86 +11,230 @@ from stylesheets import *
 class PreviewPlot(QWidget):
 	DEFAULT_CURVE = np.zeros((CURVE_FRAMES, CURVE_RESOLUTION))
 
+	# Frames drawn ahead in the direction the slider last moved, and the number of drawn
+	# frames kept
+	PREFETCH_FRAMES = 4
+	CACHED_FRAMES = 16
+
 	def __init__(self):
 		super().__init__()
 		self.setStyleSheet("background-color: black;")
 		self.setMouseTracking(True)
 		self.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
 		self.curve = PreviewPlot.DEFAULT_CURVE
-		self.renderedFrame = np.zeros((2, CURVE_RESOLUTION))
+		self.curveSource = None
 		self.frame = 0
+		self.frameStep = 1
+		self.partialFrame = None
 		self.cursorPos = None
 		self.showAltInfo = False
+		self.partialPixmap = None
+		self.framePixmaps = OrderedDict()
+		self.pixelFrames = None
+		self.pixelSize = None
 	
 
+	# Setting the curve that is already shown keeps its pixel table and drawn frames
 	def setCurve(self, curve):
+		if(curve is not None and curve is self.curveSource):
+			if(self.partialFrame is not None):
+				self.setPartialFrame(None)
+			return
+		self.curveSource = curve
 		if(curve is None):
 			self.curve = PreviewPlot.DEFAULT_CURVE
 		elif(not np.shape(curve)):
 			self.curve = curve * np.ones((CURVE_FRAMES, CURVE_RESOLUTION))
 		else:
 			self.curve = curve
+		self.partialFrame = None
+		self.partialPixmap = None
+		self.pixelSize = None
+		self.update()
+
+
+	# Samples for the current frame while the full curve is still being evaluated, at
+	# any resolution
+	def setPartialFrame(self, samples):
+		self.partialFrame = samples
+		self.partialPixmap = None
 		self.update()
 
 
 	def setFrame(self, idx):
+		if(idx != self.frame):
+			self.frameStep = 1 if idx > self.frame else -1
 		self.frame = idx
+		self.partialFrame = None
+		self.partialPixmap = None
 		self.update()
+		QTimer.singleShot(0, self.prefetch)
+
+
+	def frameValues(self):
+		return self.partialFrame if self.partialFrame is not None else self.curve[self.frame]
+
+
+	# Moving the cursor only repaints the crosshair and popup it leaves and enters, the
+	# curve under them is copied from the frame's pixmap
+	def setCursorPos(self, pos):
+		region = self.overlayRegion()
+		self.cursorPos = pos
+		self.update(region.united(self.overlayRegion()))
 	
 
 	def keyPressEvent(self, e: QKeyEvent) -> None:
 		self.showAltInfo = e.modifiers() & Qt.KeyboardModifier.ShiftModifier
-		self.update()
+		self.update(self.overlayRegion())
 		return super().keyPressEvent(e)
 
 
 	def keyReleaseEvent(self, e: QKeyEvent) -> None:
 		if(self.showAltInfo):
 			self.showAltInfo = False
-			self.update()
+			self.update(self.overlayRegion())
 		return super().keyReleaseEvent(e)
 
 
 	def mouseMoveEvent(self, e: QMouseEvent):
-		self.cursorPos = e.position().toPoint()
-		self.update()
+		self.setCursorPos(e.position().toPoint())
+
+
+	# Screen space form of values with samples along the last axis, as the x of every
+	# point and int16 rows of their y.  With more samples than pixel columns every
+	# column gets its lowest and highest sample, drawn as a vertical stroke.
+	@classmethod
+	def pixelRows(_, values, width, height):
+		h = height / 2.0
+		values = np.asarray(values)
+		n = values.shape[-1]
+		if(n > width > 0):
+			starts = (np.arange(width) * n) // width
+			ys = np.stack((np.fmin.reduceat(values, starts, axis=-1), np.fmax.reduceat(values, starts, axis=-1)), axis=-1)
+			ys = ys.reshape(ys.shape[:-2] + (2 * width,))
+			xs = np.repeat(np.arange(width) + 0.5, 2)
+		else:
+			ys = values
+			xs = np.linspace(0, width, n)
+		ys = np.nan_to_num(np.clip(ys, -1, 1)) * -h + h
+		return xs, np.rint(ys).astype(np.int16)
+
+
+	# Polyline through xs and ys, built in a numpy view of the polygon's points
+	@classmethod
+	def polyline(_, xs, ys) -> QPolygonF:
+		poly = QPolygonF()
+		poly.resize(len(xs))
+		ptr = poly.data()
+		ptr.setsize(len(xs) * 16)
+		points = np.frombuffer(ptr, np.float64).reshape(-1, 2)
+		points[:, 0] = xs
+		points[:, 1] = ys
+		return poly
+
+
+	def renderCurve(self, xs, ys):
+		dpr = self.devicePixelRatio()
+		pixmap = QPixmap(self.size() * dpr)
+		pixmap.setDevicePixelRatio(dpr)
+		pixmap.fill(Qt.GlobalColor.black)
+		p = QPainter(pixmap)
+		p.setRenderHint(QPainter.RenderHint.Antialiasing)
+		p.setPen(QPen(Qt.GlobalColor.green, 2, Qt.PenStyle.SolidLine))
+		p.drawPolyline(PreviewPlot.polyline(xs, ys))
+		p.end()
+		return pixmap
+
+
+	# Pixel rows of every frame of the curve are computed at once, whenever the curve or
+	# the widget size changes, and frames are drawn from them on demand
+	def updatePixelFrames(self):
+		size = (self.width(), self.height())
+		if(self.pixelSize != size):
+			self.pixelFrames = PreviewPlot.pixelRows(self.curve, *size)
+			self.pixelSize = size
+			self.framePixmaps.clear()
+
+
+	def framePixmap(self, frame):
+		self.updatePixelFrames()
+		pixmap = self.framePixmaps.get(frame)
+		if(pixmap is None):
+			xs, ys = self.pixelFrames
+			pixmap = self.framePixmaps[frame] = self.renderCurve(xs, ys[frame])
+			if(len(self.framePixmaps) > PreviewPlot.CACHED_FRAMES):
+				self.framePixmaps.popitem(last=False)
+		else:
+			self.framePixmaps.move_to_end(frame)
+		return pixmap
+
+
+	# Draws the next frames the slider is heading to while it is idle
+	def prefetch(self):
+		if(not self.isVisible()):
+			return
+		if(self.frame in self.framePixmaps):
+			self.framePixmaps.move_to_end(self.frame)
+		for k in range(1, PreviewPlot.PREFETCH_FRAMES + 1):
+			f = self.frame + k * self.frameStep
+			if(0 <= f < len(self.curve) and f not in self.framePixmaps):
+				self.framePixmap(f)
+
+
+	# Sample index under the cursor, the curve's y there and the popup's rectangle
+	def overlayGeometry(self):
+		values = self.frameValues()
+		cX, cY = (self.cursorPos.x(), self.cursorPos.y())
+		i = min(max(round(cX * (len(values) - 1) / max(self.width(), 1)), 0), len(values) - 1)
+		h = self.height() / 2.0
+		v = values[i]
+		curveY = int(min(max(v, -1), 1) * -h + h) if np.isfinite(v) else int(h)
+
+		popupRect = QRect(cX-80, cY-40, 80, 40)
+		if(popupRect.left() < 0):
+			popupRect.moveLeft(cX)
+		if(popupRect.top() < 0):
+			popupRect.moveTop(cY)
+		return i, curveY, popupRect
+
+
+	def overlayRegion(self):
+		if(not self.cursorPos):
+			return QRegion()
+		_, curveY, popupRect = self.overlayGeometry()
+		cX = self.cursorPos.x()
+		region = QRegion(cX - 2, 0, 5, self.height())
+		region = region.united(QRegion(0, curveY - 2, self.width(), 5))
+		return region.united(QRegion(popupRect.adjusted(-2, -2, 2, 2)))
 	
 
 	def paintEvent(self, e):
-		h = self.height() / 2.0
-		frame = (self.curve[self.frame].clip(-1, 1) * -h + h).astype('int')
-		xVals = np.linspace(0, self.width(), len(frame), dtype='int')
-		self.renderedFrame = np.array((xVals, frame))
-		points = [QPoint(xVals[i], frame[i]) for i in range(len(frame))]
+		if(self.partialFrame is None):
+			pixmap = self.framePixmap(self.frame)
+		else:
+			if(self.partialPixmap is None or self.partialPixmap.deviceIndependentSize().toSize() != self.size()):
+				self.partialPixmap = self.renderCurve(*PreviewPlot.pixelRows(self.partialFrame, self.width(), self.height()))
+			pixmap = self.partialPixmap
 		p = QPainter(self)
-		p.setRenderHint(QPainter.RenderHint.Antialiasing)
-		p.fillRect(0, 0, self.width(), self.height(), Qt.GlobalColor.black)
-		p.setPen(QPen(Qt.GlobalColor.green, 2, Qt.PenStyle.SolidLine))
-		p.drawPolyline(points)
+		p.drawPixmap(0, 0, pixmap)
 		
 		if(self.cursorPos):
-			cX, cY = (self.cursorPos.x(), self.cursorPos.y())
-			i = np.searchsorted(self.renderedFrame[0], cX)
-			curveY = self.renderedFrame[1][i]
+			values = self.frameValues()
+			i, curveY, popupRect = self.overlayGeometry()
+			cX = self.cursorPos.x()
 
 			p.setPen(QPen(Qt.GlobalColor.gray, 1, Qt.PenStyle.SolidLine))
 			p.drawLine(cX, 0, cX, self.height())
 			p.drawLine(0, curveY, self.width(), curveY)
 
-			popupRect = QRect(cX-80, cY-40, 80, 40)
-			if(popupRect.left() < 0):
-				popupRect.moveLeft(cX)
-			if(popupRect.top() < 0):
-				popupRect.moveTop(cY)
-
 			p.fillRect(popupRect, QColor(209, 212, 180))
 			p.setPen(QPen(Qt.GlobalColor.black, 2, Qt.PenStyle.SolidLine))
 
 			if(self.showAltInfo):
-				s1 = f'{2*(i/len(frame))-1:0.4f}'
+				s1 = f'{2*(i/len(values))-1:0.4f}'
 			else:
-				s1 = f'{i/len(frame):0.4f}'
-			s2 = f'{self.curve[self.frame][i]:0.4f}'
+				s1 = f'{i/len(values):0.4f}'
+			s2 = f'{values[i]:0.4f}'
 			rect = QRect(popupRect.left()+3, popupRect.top()+3, popupRect.width()-6, 15)
 			p.setFont(QFont('Consolas', 8))
 			p.drawText(rect.adjusted(0, 3, -63, 3), Qt.AlignmentFlag.AlignRight, 'w' if self.showAltInfo else 'x')
@@ -98,4 +243,3 @@ class PreviewPlot(QWidget):
 			p.drawText(rect, Qt.AlignmentFlag.AlignRight, s1)
 			p.drawText(rect.adjusted(0, 15, 0, 15), Qt.AlignmentFlag.AlignRight, s2)
 		p.end()
-
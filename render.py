@@ -0,0 +1,240 @@
+import sys
+import os
+import re
+import time
+import argparse
+import tracemalloc
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from ftypes import FNodeType
+from fcore import FCore
+from fparser import FParser, FParseError
+from fsimplify import FSimplifier
+from fplan import FPlan
+from fexport import FExport
+from fcodec import FCodec
+from fpalette import FPalette
+from options import CURVE_FRAMES, CURVE_RESOLUTION, CURVE_DTYPE
+
+
+# Headless batch renderer, turns palettes and formula lists into wavetable files
+# without Qt so that preset banks can be regenerated on machines without a display.
+#
+#   python render.py [-o OUT] [--format wav|f32|npy] [--mipmaps] [--normalize] [--remove-dc]
+#                    [--dtype float32|float64] [-j JOBS] input...
+#
+# Inputs ending in .json or .fpal are palettes (plain or indexed FPalette files),
+# presets in SET folders are named folder/preset.  Any other input is read as one
+# formula per line, blank lines and lines starting with # are ignored.  Tables are written in the
+# FExport formats, .wav and .f32 files always hold 32-bit floats.  With --mipmaps every
+# preset is written as a set of band-limited octave tables named NAME-0, NAME-1...
+
+
+# Returns (name, tree) for every node of a palette that is not a ROOT or SET
+def loadPalette(path):
+	palette = FPalette.open(path)
+	palette.loadAll(palette.root)
+	root = palette.root
+	presets = []
+	def recurse(n, folder):
+		for c in n.children():
+			name = c.name() or c.formula() or FCore.TYPE_NAMES.get(c.type(), c.type().name)
+			if(c.type() == FNodeType.SET):
+				recurse(c, f'{folder}{name}/')
+			else:
+				presets.append((folder + name, c))
+	recurse(root, '')
+	return presets
+
+
+# Returns (formula, tree) per formula line, the tree being None if it does not parse
+def loadFormulas(path):
+	presets = []
+	with open(path) as f:
+		for i, line in enumerate(f):
+			line = line.strip()
+			if(not line or line.startswith('#')):
+				continue
+			try:
+				presets.append((line, FParser.parse(line)))
+			except FParseError as e:
+				print(f'{path}:{i+1}: {e}')
+				presets.append((line, None))
+	return presets
+
+
+def fileName(idx, name, fmt='npy'):
+	slug = re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_')[:60]
+	return f'{idx:04d}_{slug or "preset"}.{fmt}'
+
+
+# Evaluates the whole table of one preset, into out if given.  Returns the table with
+# the time it took and the peak memory traced during evaluation.
+def renderPreset(n, dtype=None, out=None):
+	tracemalloc.reset_peak()
+	base = tracemalloc.get_traced_memory()[0]
+	t = time.perf_counter()
+	with np.errstate(all='ignore'):
+		v = FPlan.compile(FSimplifier.simplify(n), dtype).execute(out=out)
+	t = time.perf_counter() - t
+	return v, t, tracemalloc.get_traced_memory()[1] - base
+
+
+# Same as renderPreset() but evaluates straight into a new file at path with
+# FExport.export(), so the table is never held in memory.  Returns None for the table.
+def exportPreset(n, path, dtype=None):
+	tracemalloc.reset_peak()
+	base = tracemalloc.get_traced_memory()[0]
+	t = time.perf_counter()
+	FExport.export(FPlan.compile(FSimplifier.simplify(n), dtype), path)
+	t = time.perf_counter() - t
+	return None, t, tracemalloc.get_traced_memory()[1] - base
+
+
+# Every process already takes a core, so plans run their frame blocks serially
+def startWorker():
+	FPlan.THREADS = 1
+	tracemalloc.start()
+
+
+# Runs in a pool process: rebuilds the tree from its FCodec form and evaluates it
+# straight into the shared memory block the parent allocated for it
+def renderJob(b, shmName, shape, dtype):
+	shm = shared_memory.SharedMemory(name=shmName)
+	try:
+		out = np.ndarray(shape, dtype, buffer=shm.buf)
+		_, t, peak = renderPreset(FCodec.decodeCore(b), dtype, out)
+		del out
+	finally:
+		shm.close()
+	return t, peak
+
+
+# Yields (table, time, peak) per preset in order, or raises the preset's ValueError
+# when the result is taken.  Tables are only valid until the next one is taken.  If
+# paths are given the presets are exported to them instead and the tables are None.
+def renderSerial(presets, dtype, paths=None):
+	for i, n in enumerate(presets):
+		if(paths):
+			yield lambda n=n, path=paths[i]: exportPreset(n, path, dtype)
+		else:
+			yield lambda n=n: renderPreset(n, dtype)
+
+
+# Same as renderSerial() on a process pool.  Trees are sent encoded and each result
+# is written to its own shared memory block; at most two jobs per worker are in
+# flight, so memory stays bounded however many presets there are.  Blocks still in
+# flight when the consumer stops early are released once their jobs are done.
+def renderParallel(presets, dtype, jobs):
+	dtype = np.dtype(dtype or CURVE_DTYPE)
+	shape = (CURVE_FRAMES, CURVE_RESOLUTION)
+	nbytes = int(np.prod(shape)) * dtype.itemsize
+	with ProcessPoolExecutor(jobs, initializer=startWorker) as pool:
+		pending = deque()
+		presets = iter(presets)
+		def submit():
+			for n in presets:
+				shm = shared_memory.SharedMemory(create=True, size=nbytes)
+				try:
+					pending.append((shm, pool.submit(renderJob, FCodec.encode(n), shm.name, shape, dtype.str)))
+				except BaseException:
+					shm.close()
+					shm.unlink()
+					raise
+				return
+		try:
+			for _ in range(jobs * 2):
+				submit()
+			while(pending):
+				shm, future = pending[0]
+				submit()
+				def take(shm=shm, future=future):
+					t, peak = future.result()
+					return np.ndarray(shape, dtype, buffer=shm.buf), t, peak
+				try:
+					yield take
+				finally:
+					pending.popleft()
+					shm.close()
+					shm.unlink()
+		finally:
+			for _, future in pending:
+				future.cancel()
+			# Running jobs still write into their blocks, the pool is shut down first
+			pool.shutdown(wait=True)
+			while(pending):
+				shm, _ = pending.popleft()
+				shm.close()
+				shm.unlink()
+
+
+def render(inputs, outDir, dtype=None, jobs=1, fmt='npy', mipmaps=False, normalize=False, removeDC=False):
+	os.makedirs(outDir, exist_ok=True)
+	presets = []
+	for path in inputs:
+		presets.extend(loadPalette(path) if path.endswith(('.json', '.fpal')) else loadFormulas(path))
+
+	failed = 0
+	rendered = []
+	for i, (name, n) in enumerate(presets):
+		if(n is None):
+			failed += 1
+			print(f'{"failed":>17}  {name}')
+		elif(not n.isValid()):
+			print(f'{"skipped":>17}  {name} (invalid)')
+		else:
+			rendered.append(i)
+
+	tracemalloc.start()
+	total = time.perf_counter()
+	print(f'{"ms":>8} {"peak MB":>8}  preset')
+	trees = [presets[i][1] for i in rendered]
+	paths = [os.path.join(outDir, fileName(i, presets[i][0], fmt)) for i in rendered]
+	if(jobs > 1):
+		results = renderParallel(trees, dtype, jobs)
+	else:
+		# Plain tables are evaluated straight into their files
+		results = renderSerial(trees, dtype, None if mipmaps or normalize or removeDC else paths)
+	for i, path, take in zip(rendered, paths, results):
+		name = presets[i][0]
+		try:
+			v, t, peak = take()
+		except ValueError as e:
+			failed += 1
+			print(f'{"failed":>17}  {name}: {e}')
+			continue
+		if(mipmaps):
+			FExport.saveMipmaps(FExport.mipmaps(v, normalize=normalize, removeDC=removeDC), path)
+		elif(normalize or removeDC):
+			FExport.save(FExport.mipmaps(v, 1, normalize, removeDC)[0], path)
+		elif(v is not None):
+			FExport.save(v, path)
+		del v
+		print(f'{t*1000:8.1f} {peak/2**20:8.1f}  {name}')
+	tracemalloc.stop()
+
+	total = time.perf_counter() - total
+	print(f'{len(presets)} presets, {failed} failed, {total:0.2f} s total on {max(jobs, 1)} processes')
+	try:
+		import resource
+		print(f'process peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/2**10:0.1f} MB')
+	except ImportError:
+		pass
+	return failed
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Renders palettes and formula files to wavetables without a display.')
+	parser.add_argument('inputs', nargs='+', help='palette .json or .fpal files or text files with one formula per line')
+	parser.add_argument('-o', '--out', default='render', help='output directory (default: render)')
+	parser.add_argument('--format', choices=FExport.FORMATS, default='npy', help='output file format (default: npy)')
+	parser.add_argument('--mipmaps', action='store_true', help='write band-limited octave mipmaps of every preset')
+	parser.add_argument('--normalize', action='store_true', help='scale every table to a peak of 1')
+	parser.add_argument('--remove-dc', action='store_true', help='remove the DC offset of every frame')
+	parser.add_argument('--dtype', choices=('float32', 'float64'), help='evaluation precision (default: CURVE_DTYPE)')
+	parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='worker processes, 1 renders in this process (default: all cores)')
+	args = parser.parse_args()
+	sys.exit(1 if render(args.inputs, args.out, args.dtype, args.jobs, args.format, args.mipmaps, args.normalize, args.remove_dc) else 0)
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from fparser import FParser
+from fcodec import FCodec
+
+
+def encoded():
+	n = FParser.parse('sin(x*3.5)+y/7-1e300')
+	n.children()[0].setName('wave')
+	return FCodec.encode(n)
+
+
+def test_round_trip():
+	b = encoded()
+	assert FCodec.encode(FCodec.decode(b)) == b
+
+
+def test_truncated_tree():
+	b = encoded()
+	for size in range(len(b)):
+		with pytest.raises(ValueError):
+			FCodec.decode(b[:size])
+
+
+def test_corrupt_tree():
+	b = encoded()
+	for i in range(len(b)):
+		for bit in range(8):
+			c = bytearray(b)
+			c[i] ^= 1 << bit
+			try:
+				FCodec.decode(bytes(c))
+			except ValueError:
+				pass
+
+
+def test_truncated_document(tmp_path):
+	path = tmp_path / 'f.fdoc'
+	FCodec.save(str(path), FCodec.decode(encoded()), np.zeros((4, 4)))
+	b = path.read_bytes()
+	# Cut between the tree and its table the document is a valid one without table
+	end = len(FCodec.DOCUMENT_MAGIC) + 8 + len(encoded())
+	start = end + -end % FCodec.DOCUMENT_ALIGN
+	for size in [*range(end), *range(start + 1, len(b))]:
+		path.write_bytes(b[:size])
+		with pytest.raises(ValueError):
+			FCodec.load(str(path))
@@ -0,0 +1,55 @@
+import numpy as np
+
+from ftypes import FNodeType
+from fparser import FParser
+from fplan import FPlan
+from fcore import FCore
+from fsimplify import FSimplifier
+
+
+def evaluate(s):
+	with np.errstate(all='ignore'):
+		return FPlan.compile(FParser.parse(s)).execute()
+
+
+def test_nested_comparisons_are_not_merged():
+	n = FParser.parse('(x>0)>(y>0)')
+	assert n.type() == FNodeType.GREATER_THAN
+	assert [c.type() for c in n.children()] == [FNodeType.GREATER_THAN, FNodeType.GREATER_THAN]
+
+	n = FParser.parse('(x==0)==0')
+	assert n.type() == FNodeType.EQUAL
+	assert [c.type() for c in n.children()] == [FNodeType.EQUAL, FNodeType.CONSTANT]
+
+
+def test_nested_comparisons_evaluate():
+	assert evaluate('(x>0)>(y>0)').mean() == 0.25
+	v = evaluate('(x==0)==0')
+	assert np.array_equal(v, evaluate('x!=0'))
+	assert v.mean() > 0.99
+
+
+def test_arithmetic_still_merges():
+	n = FParser.parse('x-y-z')
+	assert n.type() == FNodeType.SUBTRACT and len(n.children()) == 3
+	n = FParser.parse('(x&&y)&&z')
+	assert n.type() == FNodeType.AND and len(n.children()) == 3
+
+
+def test_comparison_formula_round_trip():
+	n = FParser.parse('x<y')
+	n.addChild(FParser.parse('z'))
+	assert n.formula() == 'x<y<z'
+	assert FParser.parse(n.formula()).formula() == 'x<y<z'
+	with np.errstate(all='ignore'):
+		assert np.array_equal(FPlan.compile(n).execute(), evaluate(n.formula()))
+
+
+def test_single_operand_matches_formula():
+	for t in (FNodeType.LESS_THAN, FNodeType.EQUAL, FNodeType.AND, FNodeType.OR):
+		n = FCore(t)
+		n.addChild(FParser.parse('x-0.5'))
+		assert n.formula() == 'x-0.5'
+		with np.errstate(all='ignore'):
+			assert np.array_equal(FPlan.compile(n).execute(), evaluate('x-0.5'))
+			assert np.array_equal(FPlan.compile(FSimplifier.simplify(n)).execute(), evaluate('x-0.5'))
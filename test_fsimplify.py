@@ -0,0 +1,69 @@
+import numpy as np
+
+from fnode import FNode
+from fparser import FParser
+from fsimplify import FSimplifier
+from ftree import FTree
+from fpalette import FPalette
+from fplan import FPlan
+from options import CURVE_FRAMES, CURVE_RESOLUTION
+
+
+# Deeper than the default recursion limit
+DEPTH = 1200
+
+
+def test_deep_tree_formula_and_simplify():
+	s = 'sin(' * DEPTH + 'x' + ')' * DEPTH
+	n = FParser.parse(s)
+	assert n.formula() == s
+	assert n.copy().formula() == s
+
+	t = FSimplifier.simplify(n)
+	assert t.key() == FSimplifier.simplify(n.copy()).key()
+	v = FPlan.compile(t, np.float64).execute()
+
+	expected = np.linspace(-1, 1, CURVE_RESOLUTION)
+	for _ in range(DEPTH):
+		expected = np.sin(expected)
+	assert v.shape == (CURVE_FRAMES, CURVE_RESOLUTION)
+	assert np.allclose(v[0], expected)
+
+
+def test_simplify_folds_deep_constants():
+	s = '1-(' * DEPTH + '1' + ')' * DEPTH
+	expected = 1
+	for _ in range(DEPTH):
+		expected = 1 - expected
+	assert FSimplifier.simplify(FParser.parse(s)).value() == expected
+
+
+def test_deep_node_plan():
+	s = 'sin(' * DEPTH + 'x' + ')' * DEPTH
+	n = FNode.fromString(s)
+	assert n.formula() == s
+	assert n.plan().execute().shape == (CURVE_FRAMES, CURVE_RESOLUTION)
+	n.delete()
+
+
+def test_deep_tree_json():
+	s = 'sin(' * DEPTH + '-x' + ')' * DEPTH
+	n = FNode.fromString(s)
+	assert n.copy().formula() == s
+	assert FNode.fromString(n.asJSON()).formula() == s
+	assert FNode.fromJSON(n.asJSON(stringify=False)).formula() == s
+	assert n.simplified()[1].count('sin(') == DEPTH
+	assert FTree.fromJSON(FTree.fromNode(n.core()).asJSON()).toCore().formula() == s
+	n.delete()
+
+
+def test_deep_palette(tmp_path):
+	path = str(tmp_path / 'palette.fpal')
+	palette = FPalette(path)
+	preset = FParser.parse('sin(' * DEPTH + 'x' + ')' * DEPTH)
+	palette.root.addChild(preset)
+	palette.save()
+	palette = FPalette.open(path)
+	preset = palette.root._children[0]
+	palette.load([preset])
+	assert preset.formula() == 'sin(' * DEPTH + 'x' + ')' * DEPTH